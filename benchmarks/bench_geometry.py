@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""Benchmark the geometry module on synthetic periodic structures"""
+
+################################################################################
+# Preliminaries
+################################################################################
+import sys, os, argparse, logging, json, time, platform, tracemalloc
+import numpy as np
+from useful_functions import logger_setup
+import geometry
+
+#-------------------------------------------------------------------------------
+# Synthetic structures
+#-------------------------------------------------------------------------------
+def random_geom(n_at, density=0.1, seed=0):
+    """Random positions in a cubic periodic box with the given number density (atoms/A^3)"""
+    from ase import Atoms
+    rng = np.random.default_rng(seed)
+    side = (n_at/density)**(1/3)
+    return Atoms('C%i' % n_at, positions=rng.random((n_at, 3))*side,
+                 cell=np.eye(3)*side, pbc=True)
+
+def fcc_geom(n_at, a=3.6):
+    """Cubic fcc supercell with about n_at atoms"""
+    from ase import Atoms
+    n_rep = max(1, int(round((n_at/4)**(1/3))))
+    basis = np.array([[0, 0, 0], [0, .5, .5], [.5, 0, .5], [.5, .5, 0]])
+    grid = np.stack(np.meshgrid(*[np.arange(n_rep)]*3, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    pos = ((grid + basis)*a).reshape(-1, 3)
+    return Atoms('Cu%i' % len(pos), positions=pos, cell=np.eye(3)*a*n_rep, pbc=True)
+
+def hex_bilayer_geom(n_at, a=2.46, d=3.4, vacuum=20.):
+    """AB-stacked honeycomb bilayer with about n_at atoms"""
+    from ase import Atoms
+    n_rep = max(1, int(round((n_at/4)**(1/2))))
+    cell = np.array([[a, 0, 0], [a/2, a*3**.5/2, 0], [0, 0, d+vacuum]])
+    basis = np.array([[0, 0], [1/3, 1/3]])
+    grid = np.stack(np.meshgrid(*[np.arange(n_rep)]*2, indexing='ij'), axis=-1).reshape(-1, 1, 2)
+    frac = (grid + basis).reshape(-1, 2)
+    bottom = np.c_[np.dot(frac, cell[:2, :2]), np.full(len(frac), vacuum/2)]
+    top = np.c_[np.dot(frac + 1/3, cell[:2, :2]), np.full(len(frac), vacuum/2+d)]
+    sc = cell*[[n_rep], [n_rep], [1]]
+    geom = Atoms('C%i' % (2*len(frac)), positions=np.r_[bottom, top], cell=sc, pbc=True)
+    geom.wrap()
+    return geom
+
+GEOMS = {"random": random_geom, "fcc": fcc_geom, "hex_bilayer": hex_bilayer_geom}
+
+#-------------------------------------------------------------------------------
+# Benchmarked calls. Each takes an Atoms obj and returns a function without arguments
+# and the number of calls of the benchmarked function it makes (1 unless it loops).
+#-------------------------------------------------------------------------------
+def _distance_pbc_loop(geom, max_loop):
+    U, pos = geom.cell.T, geom.positions[:max_loop]
+    return lambda: [geometry.distance_pbc(pos[i], pos[i-1], U) for i in range(len(pos))], len(pos)
+
+def _distance_pbc_batch(geom):
+    U, pos = geom.cell.T, geom.positions
+    idx = np.arange(len(pos))
+    return lambda: geometry.distance_pbc_batch(pos, pos, U, pairs=(idx, idx-1)), 1
+
+def _zcut(geom):
+    z_cut = geom.positions[:, -1].mean()
+    return lambda: geometry.zcut_geom(geom, z_cut), 1
+
+def _plane_at_r(geom):
+    n, p = np.array([0.1, 0.2, 1.]), geom.positions.mean(axis=0)
+    return lambda: geometry.plane_at_r(geom.positions, n, p), 1
+
+def bench_calls(max_loop):
+    """Dictionary of name -> call builder of the benchmarked functions"""
+    return {
+        "distance_pbc": lambda g: _distance_pbc_loop(g, max_loop),
+        "distance_pbc_batch": _distance_pbc_batch,
+        "in_cell": lambda g: (lambda: geometry.in_cell(g.positions, g.cell.T), 1),
+        "map2uc": lambda g: (lambda: geometry.map2uc(g.positions, g.cell.T), 1),
+        "pbc_displ": lambda g: (lambda: geometry.pbc_displ(g, [0.7, 1.1, 0.]), 1),
+        "zcut_geom": _zcut,
+        "expand_geom": lambda g: (lambda: geometry.expand_geom(g, 1.01), 1),
+        "plane_at_r": _plane_at_r,
+    }
+
+#-------------------------------------------------------------------------------
+# Timing and memory
+#-------------------------------------------------------------------------------
+def time_call(f, repeat=3, min_time=0.2):
+    """Best time per call over repeat rounds. Each round lasts at least min_time."""
+    best = np.inf
+    for _ in range(repeat):
+        n_call, t0 = 0, time.perf_counter()
+        while True:
+            f()
+            n_call += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed/n_call)
+    return best
+
+def peak_memory(f):
+    """Peak memory (bytes) allocated during one call, as seen by tracemalloc"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+def run_benchmarks(sizes, geoms, funcs, repeat=3, min_time=0.2, max_loop=10**4):
+    """Run funcs on each geometry type and size. Return nested dict geom -> func -> N -> results.
+
+    Results are the time of one run ("time"), the number of calls of the function in it ("n_calls",
+    less than N for Python loops capped at max_loop), the time per call ("time_per_call") and "peak_mem"."""
+
+    c_log = logger_setup(__name__)
+    calls = bench_calls(max_loop)
+    results = {}
+    for g_name in geoms:
+        results[g_name] = {f_name: {} for f_name in funcs}
+        for size in sizes:
+            geom = GEOMS[g_name](size)
+            n_at = len(geom)
+            for f_name in funcs:
+                f, n_calls = calls[f_name](geom)
+                t = time_call(f, repeat=repeat, min_time=min_time)
+                mem = peak_memory(f)
+                c_log.info("%12s %20s N=%8i %12.3e s %12i B (%i calls)", g_name, f_name, n_at, t, mem, n_calls)
+                results[g_name][f_name][str(n_at)] = {"time": t, "n_calls": n_calls,
+                                                      "time_per_call": t/n_calls, "peak_mem": mem}
+    return results
+
+def compare_results(old, new, threshold=0.1):
+    """Compare two benchmark json dictionaries.
+
+    Return list of (geom, func, N, old time, new time, ratio) for the common entries
+    and the list of the entries slower than (1+threshold) times the old one.
+    Entries that did not time the same number of calls (n_calls, 1 if missing) are skipped."""
+    c_log = logger_setup(__name__)
+    rows, regressions = [], []
+    for g_name, funcs in new["results"].items():
+        for f_name, sizes in funcs.items():
+            for n_at, res in sizes.items():
+                try:
+                    res_old = old["results"][g_name][f_name][n_at]
+                except KeyError:
+                    continue
+                if res_old.get("n_calls", 1) != res.get("n_calls", 1):
+                    c_log.warning("%s %s N=%s: different number of calls timed, skipped", g_name, f_name, n_at)
+                    continue
+                t_old = res_old["time"]
+                row = (g_name, f_name, int(n_at), t_old, res["time"], res["time"]/t_old)
+                rows.append(row)
+                if row[-1] > 1+threshold:
+                    regressions.append(row)
+    return rows, regressions
+
+################################################################################
+# Command line
+################################################################################
+def bench_geometry(argv):
+    """Time the geometry module functions against the number of atoms N.
+
+    Results (time per run, calls per run and peak memory) are saved in json format.
+    With --compare OLD NEW two json files are compared and regressions beyond the threshold are flagged:
+    exit status is 1 if any is found."""
+
+    #-------------------------------------------------------------------------------
+    # Argument parser
+    #-------------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=bench_geometry.__doc__)
+    # Optional args
+    parser.add_argument('-o', '--output',
+                        dest='output', default="bench_geometry.json",
+                        help='output json file (default bench_geometry.json);')
+    parser.add_argument('-n', '--sizes',
+                        dest='sizes', type=int, nargs='+', default=[10**2, 10**3, 10**4, 10**5, 10**6],
+                        help='approximate number of atoms (default 1e2 to 1e6);')
+    parser.add_argument('-g', '--geoms',
+                        dest='geoms', nargs='+', default=list(GEOMS), choices=list(GEOMS),
+                        help='synthetic structures to use (default all);')
+    parser.add_argument('-f', '--funcs',
+                        dest='funcs', nargs='+', default=list(bench_calls(0)), choices=list(bench_calls(0)),
+                        help='functions to benchmark (default all);')
+    parser.add_argument('--repeat',
+                        dest='repeat', type=int, default=3,
+                        help='number of timing rounds, best is kept (default 3);')
+    parser.add_argument('--max_loop',
+                        dest='max_loop', type=int, default=10**4,
+                        help='max number of calls of single-vector functions in Python loops (default 1e4);')
+    parser.add_argument('--compare',
+                        dest='compare', nargs=2, default=None, metavar=('OLD', 'NEW'),
+                        help='compare two json result files instead of running;')
+    parser.add_argument('--threshold',
+                        dest='threshold', type=float, default=0.1,
+                        help='relative slowdown flagged as regression (default 0.1);')
+    parser.add_argument('--debug',
+                        action='store_true', dest='debug',
+                        help='show debug informations.')
+
+    #-------------------------------------------------------------------------------
+    # Initialize and check variables
+    #-------------------------------------------------------------------------------
+    args = parser.parse_args(argv) # Process arguments
+
+    # Set up logger and debug options
+    c_log = logger_setup(__name__)
+    c_log.setLevel(logging.INFO)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+    c_log.debug(args)
+
+    #-------------------------------------------------------------------------------
+    # Compare mode
+    #-------------------------------------------------------------------------------
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            rows, regressions = compare_results(json.load(f_old), json.load(f_new), args.threshold)
+        for row in rows:
+            flag = "REGRESSION" if row in regressions else ""
+            print("%12s %20s %8i %12.3e %12.3e %8.2f %s" % (*row, flag))
+        c_log.info("%i regressions beyond %.0f%% out of %i entries", len(regressions), 100*args.threshold, len(rows))
+        return 1 if regressions else 0
+
+    #-------------------------------------------------------------------------------
+    # Run and save
+    #-------------------------------------------------------------------------------
+    results = run_benchmarks(args.sizes, args.geoms, args.funcs,
+                             repeat=args.repeat, max_loop=args.max_loop)
+    meta = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "cpu_count": os.cpu_count()}
+    with open(args.output, 'w') as out_file:
+        json.dump({"meta": meta, "results": results}, out_file, indent=1)
+    c_log.info("Results written in %s", args.output)
+    return 0
+
+################################################################################
+# MAIN
+################################################################################
+if __name__ == "__main__":
+    exit(bench_geometry(sys.argv[1:]))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Benchmark orderedset.OrderedSet against the previous linked-list implementation"""
+
+################################################################################
+# Preliminaries
+################################################################################
+import sys, argparse, logging, time, tracemalloc
+import collections.abc
+from useful_functions import logger_setup
+from orderedset import OrderedSet
+
+class LinkedOrderedSet(collections.abc.MutableSet):
+    """Previous OrderedSet: doubly linked list of [key, prev, next] nodes. Kept as reference."""
+
+    def __init__(self, iterable=None):
+        self.end = end = []
+        end += [None, end, end]         # sentinel node for doubly linked list
+        self.map = {}                   # key --> [key, prev, next]
+        if iterable is not None:
+            self |= iterable
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def add(self, key):
+        if key not in self.map:
+            end = self.end
+            curr = end[1]
+            curr[2] = end[1] = self.map[key] = [key, curr, end]
+
+    def discard(self, key):
+        if key in self.map:
+            key, prev, next = self.map.pop(key)
+            prev[2] = next
+            next[1] = prev
+
+    def __iter__(self):
+        end = self.end
+        curr = end[2]
+        while curr is not end:
+            yield curr[0]
+            curr = curr[2]
+
+#-------------------------------------------------------------------------------
+# Timing and memory
+#-------------------------------------------------------------------------------
+def measure(f):
+    """Time (s) and peak memory (bytes, tracemalloc) of one call of f"""
+    t0 = time.perf_counter()
+    res = f()
+    dt = time.perf_counter() - t0
+    del res
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    res = f()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return dt, peak
+
+def bench_orderedset(argv):
+    """Time and memory of construction, membership, iteration and set algebra of the two OrderedSet classes."""
+
+    #-------------------------------------------------------------------------------
+    # Argument parser
+    #-------------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=bench_orderedset.__doc__)
+    parser.add_argument('-n',
+                        dest='n', type=int, default=10**6,
+                        help='number of elements (default 1e6);')
+    parser.add_argument('--debug',
+                        action='store_true', dest='debug',
+                        help='show debug informations.')
+    args = parser.parse_args(argv)
+
+    c_log = logger_setup(__name__)
+    c_log.setLevel(logging.INFO)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+    c_log.debug(args)
+
+    #-------------------------------------------------------------------------------
+    # Run
+    #-------------------------------------------------------------------------------
+    keys_a = list(range(args.n))
+    keys_b = list(range(args.n//2, args.n + args.n//2))
+    print("%10s %20s %12s %14s" % ("class", "operation", "time (s)", "peak mem (B)"))
+    for cls in (LinkedOrderedSet, OrderedSet):
+        a, b = cls(keys_a), cls(keys_b)
+        tests = {"construct": lambda: cls(keys_a),
+                 "contains": lambda: sum(1 for k in keys_b if k in a),
+                 "iterate": lambda: sum(1 for _ in a),
+                 "union": lambda: a | b,
+                 "intersection": lambda: a & b,
+                 "difference": lambda: a - b}
+        for name, f in tests.items():
+            dt, peak = measure(f)
+            print("%10s %20s %12.4f %14i" % (cls.__name__[:10], name, dt, peak))
+    return 0
+
+################################################################################
+# MAIN
+################################################################################
+if __name__ == "__main__":
+    exit(bench_orderedset(sys.argv[1:]))
@@ -2,11 +2,15 @@
 
 import sys
 import os, argparse, logging
-import ase.io
-from ase.build import sort as ase_sort
+from useful_functions import lazy_import, enable_profiling, open_stream, file_compression
+# Heavy packages are imported only when needed
+ase_io = lazy_import("ase.io")
+ase_build = lazy_import("ase.build")
 
 def dir2car(argv):
-    """Convert poscar file from fractional coordinates (Direct) to Cartesian"""
+    """Convert poscar file from fractional coordinates (Direct) to Cartesian.
+
+    Input can be gzip, bz2 or xz compressed; with -i the file keeps its compression."""
 
     #-------------------------------------------------------------------------------
     # Argument parser
@@ -40,7 +44,9 @@ def dir2car(argv):
     logging.basicConfig(format=std_format)
     c_log.setLevel(logging.INFO)
     # Set debug option
-    if args.debug: c_log.setLevel(logging.DEBUG)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
 
     c_log.debug(args)
 
@@ -50,7 +56,8 @@ def dir2car(argv):
     #++++++++ STDIN ++++++++++ If no filename, use stdin...
     if args.filename is None:
         c_log.info("Reading from stdin")
-        geom = ase_sort(ase.io.read(sys.stdin, format=ase_format))
+        with open_stream(None) as in_stream: # Possibly compressed
+            geom = ase_build.sort(ase_io.read(in_stream, format=ase_format))
         with sys.stdout as out_stream:
             geom.write(out_stream, format=ase_format, vasp5=True, direct=False)
         # Done, exit
@@ -61,11 +68,13 @@ def dir2car(argv):
         if not os.path.exists(args.filename):
             c_log.error("File %s does not exists", args.filename)
             exit(1) # Exit with error
-        geom = ase_sort(ase.io.read(args.filename, format=ase_format))
+        with open_stream(args.filename) as in_stream: # Possibly compressed
+            geom = ase_build.sort(ase_io.read(in_stream, format=ase_format))
 
-        # Modify file in place
+        # Modify file in place, keeping its compression
         if args.inplace:
-            geom.write(args.filename, format=ase_format, vasp5=True, direct=False)
+            with open_stream(args.filename, 'w', compression=file_compression(args.filename)) as out_stream:
+                geom.write(out_stream, format=ase_format, vasp5=True, direct=False)
         # Write on stdout
         else:
             with sys.stdout as out_stream:
@@ -1,6 +1,54 @@
 # A module to perform various geometry operations
+#
+# Cell convention: the cell vectors are the COLUMNS of the cell matrix U, so that a position is r = U.f,
+# with f the fractional coordinates. ASE stores cell vectors as rows: pass atoms.cell.T (or use Cell.from_ase).
+import functools
 import numpy as np
-from useful_functions import logger_setup
+from useful_functions import logger_setup, profiled
+
+#---------------------------------------------------------------------------------------
+# CELL WITH CACHED QUANTITIES
+#---------------------------------------------------------------------------------------
+class Cell:
+    """Cell matrix (vectors as columns) with its derived quantities computed once.
+
+    Attributes: matrix, inv (inverse), metric (metric tensor G_ij = a_i.a_j), volume,
+    reciprocal (reciprocal vectors as columns, with the 2pi factor: a_i.b_j = 2pi delta_ij).
+    Arrays are read-only: build a new Cell if the cell changes."""
+
+    __slots__ = ('matrix', 'inv', 'metric', 'volume', 'reciprocal')
+
+    def __init__(self, matrix):
+        self.matrix = np.array(matrix, dtype=float)
+        if self.matrix.ndim != 2 or self.matrix.shape[0] != self.matrix.shape[1]:
+            raise ValueError("Cell matrix must be square")
+        self.inv = np.linalg.inv(self.matrix)
+        self.metric = np.dot(self.matrix.T, self.matrix)
+        self.volume = abs(np.linalg.det(self.matrix))
+        self.reciprocal = 2*np.pi*self.inv.T
+        for a in (self.matrix, self.inv, self.metric, self.reciprocal):
+            a.flags.writeable = False
+
+    @classmethod
+    def from_ase(cls, cell):
+        """Cell from an ASE Atoms or Cell object (row-wise vectors)"""
+        if hasattr(cell, 'get_cell'):
+            cell = cell.get_cell()
+        return as_cell(np.array(cell).T)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.matrix.tolist())
+
+@functools.lru_cache(maxsize=256)
+def _cached_cell(key, shape):
+    return Cell(np.frombuffer(key).reshape(shape))
+
+def as_cell(U):
+    """Return U as Cell object. Raw matrices with the same content share the same (cached) Cell."""
+    if isinstance(U, Cell):
+        return U
+    U = np.ascontiguousarray(U, dtype=float)
+    return _cached_cell(U.tobytes(), U.shape)
 
 #---------------------------------------------------------------------------------------
 # MINIMUM IMAGE CONVENTION TOOLS
@@ -8,36 +56,93 @@ from useful_functions import logger_setup
 def frac_part(x):
     return x - np.floor(x+0.5) # Element-wise floor from numpy
 
+@profiled
 def distance_pbc(v1, v2, U):
-    """Distance between N-dim vectors v1 and v2 according to Minimum Imgage defined by matrix U. Careful with NumPy vs ours definition of matrix, i.e. row-wise vs col-wise. I think. Double-check. And correct maybe."""
-    Uinv = np.linalg.inv(U)
+    """Distance between N-dim vectors v1 and v2 according to Minimum Imgage defined by matrix U.
+
+    U holds the cell vectors as columns (see module header), e.g. atoms.cell.T for ASE, or is a Cell."""
+    U = as_cell(U)
     dif = v1-v2 #joining vector in real space
-    trasf = np.dot(Uinv,dif)  #go to normalized cell-units
+    trasf = np.dot(U.inv,dif)  #go to normalized cell-units
     unit = frac_part(trasf) #-0.5 to 0.5 interval in normalized cell-units
-    dif=np.dot(U,unit) #minimal vector in real space
+    dif=np.dot(U.matrix,unit) #minimal vector in real space
     return np.linalg.norm(dif) # return norm in real space
 
-def in_cell(v, M, tol=0):
-    """Return True is N-dim v is inside the cell defined by M False otherwise."""
-    Minv = np.linalg.inv(M) # Np is row-wise, we want the matrix to be column wise.
-    vt = np.dot(Minv, v)
-    if  any([xi<(0-tol) for xi in vt]) or any([xi>(1+tol) for xi in vt]): # Is there a better way to do it?
-        return False
-    return True
-
-def map2uc(v, U):
-    """Map a position in N-dim v back to the fractional position insde the unit cell defined by U"""
-    from math import floor
-    Uinv = np.linalg.inv(U)
-    vt = np.dot(Uinv, v)  # Go to normalized cell-units
-    vt_unit = np.array([ xi - floor(xi) for xi in vt])
-    v_unit = np.dot(U, vt_unit)
+@profiled
+def distance_pbc_batch(r1, r2, U, pairs=None, chunk_size=2**18):
+    """Minimum Image distances between position arrays r1 (N,dim) and r2 (M,dim) in cell U.
+
+    U follows the same convention as distance_pbc, i.e. the cell vectors are the columns of U, or is a Cell.
+    If pairs is None the full (N,M) distance matrix is returned.
+    If pairs is given as (i_list, j_list) only the distances between r1[i] and r2[j] are returned (1D array).
+
+    The cell is inverted once per call. Large inputs are processed in blocks of about chunk_size
+    distances, so the temporary (block, dim) arrays keep the memory bounded: about 4*dim float64
+    per distance (96 B in 3D), i.e. some 25 MB with the default on top of the output."""
+
+    U = as_cell(U)
+    Uinv, U = U.inv, U.matrix
+    r1 = np.atleast_2d(np.asarray(r1, dtype=float))
+    r2 = np.atleast_2d(np.asarray(r2, dtype=float))
+    if r1.shape[-1] != U.shape[0] or r2.shape[-1] != U.shape[0]:
+        raise ValueError("Positions and cell must have the same dimension")
+    # Go to normalized cell-units once for all positions
+    f1 = np.dot(r1, Uinv.T)
+    f2 = np.dot(r2, Uinv.T)
+
+    #++++++++ PAIRS ++++++++++ Only the requested couples
+    if pairs is not None:
+        i_idx, j_idx = (np.asarray(x, dtype=int) for x in pairs)
+        if i_idx.shape != j_idx.shape:
+            raise ValueError("Pair index lists must have the same length")
+        dist = np.empty(i_idx.shape[0])
+        step = max(1, int(chunk_size))
+        for s in range(0, i_idx.shape[0], step):
+            unit = frac_part(f1[i_idx[s:s+step]] - f2[j_idx[s:s+step]])
+            dist[s:s+step] = np.linalg.norm(np.dot(unit, U.T), axis=-1)
+        return dist
+
+    #++++++++ MATRIX ++++++++++ All couples, row blocks of r1
+    n, m = r1.shape[0], r2.shape[0]
+    dist = np.empty((n, m))
+    step = max(1, int(chunk_size) // max(m, 1))
+    for s in range(0, n, step):
+        unit = frac_part(f1[s:s+step, None, :] - f2[None, :, :]) # -0.5 to 0.5 interval in normalized cell-units
+        dist[s:s+step] = np.linalg.norm(np.dot(unit, U.T), axis=-1) # norm of minimal vector in real space
+    return dist
+
+@profiled
+def in_cell(v, M, tol=0, Minv=None):
+    """Return True is N-dim v is inside the cell defined by M False otherwise.
+
+    v can also be an array of vectors (one per row): a boolean mask is returned.
+    M is a matrix with vectors as columns or a Cell. The inverse can also be given as Minv."""
+    if Minv is None:
+        Minv = as_cell(M).inv # Cached, not computed at each call
+    vt = np.dot(v, np.transpose(Minv)) # Same as Minv.v, for each row of v
+    inside = np.all((vt >= -tol) & (vt <= 1+tol), axis=-1)
+    if np.ndim(inside) == 0:
+        return bool(inside)
+    return inside
+
+@profiled
+def map2uc(v, U, Uinv=None):
+    """Map a position in N-dim v back to the fractional position insde the unit cell defined by U
+
+    v can also be an array of vectors (one per row), all mapped at once.
+    U is a matrix with vectors as columns or a Cell. The inverse can also be given as Uinv."""
+    U = as_cell(U)
+    if Uinv is None:
+        Uinv = U.inv # Cached, not computed at each call
+    vt = np.dot(v, np.transpose(Uinv))  # Go to normalized cell-units
+    vt_unit = vt - np.floor(vt)
+    v_unit = np.dot(vt_unit, U.matrix.T)
     return v_unit
 
 #---------------------------------------------------------------------------------------
 # MANIPULATIONS
 #---------------------------------------------------------------------------------------
-def vector_lin_stretch(vec, stretch, s_dir):
+def vector_lin_stretch(vec, stretch, s_dir=None):
     """Stretch a vector by a given factor. Optionally along a direction.
 
     As input: the vector to strerch, the scaling factor, the direction of scaling.
@@ -45,52 +150,90 @@ def vector_lin_stretch(vec, stretch, s_dir):
     """
     c_log = logger_setup(__name__)
 
-    norm = np.linalg.norm(s_dir)
-    vec = np.array(vec)
+    vec = np.array(vec, dtype=float)
+    norm = np.linalg.norm(s_dir) if s_dir is not None else 0
 
     # Stretch of a in s dir: v_{stretched}=v_{orth-s}+a*(v.s/|s|)s/|s|
     if norm:
-        c_log.info("Directional case: stretching along given direction ("+"%.5f"*len(s)+")", *s)
-        s_dir = np.array(s_dir)/norm   # normalize direction, safer
-        return vec + (stretch-1.)*dot(vec, s_dir)*s_dir
+        s_dir = np.array(s_dir, dtype=float)/norm   # normalize direction, safer
+        c_log.info("Directional case: stretching along given direction ("+" %.5f"*len(s_dir)+")", *s_dir)
+        return vec + (stretch-1.)*np.dot(vec, s_dir)*s_dir
+    return vector_iso_stretch(vec, stretch)
 
 def vector_iso_stretch(vec, stretch):
+    """Stretch a vector by a given factor along all directions"""
+    c_log = logger_setup(__name__)
     # Isotropic direction
     c_log.info("Isotropic case: stretch along all directions of factor %.5f", stretch)
-    return vec*stretch
+    return np.array(vec, dtype=float)*stretch
 
+@profiled
 def pbc_displ(lattice, v):
     """Traslate a layer of a given displacment vector and map it back to unit cell.
     Lattice must be ASE object"""
 
     from ase import Atoms
     # Check it makes sense
-    if type(lattice) != Atoms:
+    if not isinstance(lattice, Atoms):
         raise TypeError
-    if type(v) != np.array:
-        try:
-            v = np.array(v)
-        except:
-            raise ValueError
+    try:
+        v = np.asarray(v, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError
 
     d_lat = lattice.copy()
-    # Move each lattice point. Map it back to cell if needed.
-    d_lat.set_positions([map2uc(atm.position+v, lattice.cell.T)
-                         for atm in lattice])
+    # Move all lattice points at once. Map them back to cell if needed.
+    d_lat.set_positions(pbc_displ_positions(lattice, v[None, :])[0])
     return d_lat
 
-def zcut_geom(geom, z_cut):
-    """Split an ASE Object along a plane perpendicular to the vertical (last) dimension"""
+@profiled
+def pbc_displ_positions(lattice, vs):
+    """Positions of a layer traslated by each of the K given displacement vectors, mapped back to unit cell.
+
+    Lattice must be ASE object, vs a (K,3) array. Return a (K,N,3) array of positions.
+    The Atoms object is not copied: the shift and the wrapping are done on scaled positions."""
 
     from ase import Atoms
-    import numpy as np
-    from numpy import r_, c_
+    if not isinstance(lattice, Atoms):
+        raise TypeError
+    try:
+        vs = np.atleast_2d(np.asarray(vs, dtype=float))
+    except (TypeError, ValueError):
+        raise ValueError
+
+    cell = Cell.from_ase(lattice) # ASE cell is row-wise
+    scaled = np.dot(lattice.positions, cell.inv.T) # (N,3)
+    d_scaled = np.dot(vs, cell.inv.T) # (K,3)
+    new_scaled = scaled[None, :, :] + d_scaled[:, None, :]
+    new_scaled -= np.floor(new_scaled) # Back in the unit cell
+    return np.dot(new_scaled, cell.matrix.T)
+
+def atoms_subset(geom, mask):
+    """Atoms of the ASE structure geom selected by mask, as a new bare Atoms object.
+
+    Same result as Atoms([atom for atom, m in zip(geom, mask) if m]): per-atom properties are kept,
+    while cell, pbc, constraints and info are not (geom[mask] would copy them)."""
+    sub = geom[mask]
+    sub.set_cell(np.zeros((3, 3)))
+    sub.set_pbc(False)
+    sub.set_constraint()
+    sub.info = {}
+    return sub
+
+@profiled
+def zcut_geom(geom, z_cut):
+    """Split an ASE Object along a plane perpendicular to the vertical (last) dimension.
+
+    Top and bottom get the new cells, with pbc False and no constraints (see atoms_subset)."""
+
+    from numpy import r_
     c_log = logger_setup(__name__)
 
-    # Split top and bottom
+    # Split top and bottom with masks on the vertical coordinate
     # It's a new cell, starting at origin, positions must be reset
-    bottom = Atoms([atm for atm in geom if atm.position[-1] < z_cut])
-    top = Atoms([atm for atm in geom if atm.position[-1] > z_cut])
+    z = geom.positions[:, -1]
+    bottom = atoms_subset(geom, z < z_cut)
+    top = atoms_subset(geom, z > z_cut)
 
     # Check that it makes sense: no empty objects
     if len(top) == 0 or len(bottom) == 0:
@@ -98,23 +241,20 @@ def zcut_geom(geom, z_cut):
         raise ValueError
 
     # Set top layer positions and cell
-    top.set_positions([x-r_[geom.cell[-1][:-1], z_cut]
-                      for x in top.positions])
+    top.set_positions(top.positions - r_[geom.cell[-1][:-1], z_cut])
     top_cell = geom.get_cell()
     top_cell[-1] = geom.cell[-1] - [0, 0, z_cut]
     top.set_cell(top_cell)
 #    top.wrap() # Should not be needed
 
     # Set bottom layer cell. Here positions should be fine already.
-    bottom_cell = geom.get_cell()
-    bottom_cell = np.array([v for v in [*geom.cell[:-1],
-                                        r_[geom.cell[-1][:-1], z_cut]]
-                           ])
+    bottom_cell = np.array([*geom.cell[:-1], r_[geom.cell[-1][:-1], z_cut]])
     bottom.set_cell(bottom_cell)
 
     # Return the two objects
     return (top, bottom)
 
+@profiled
 def expand_geom(geom, factor):
     """Expand a ASE Atoms structure isotropically by a given factor. Keeps relative coordinate fixed"""
     geom=geom.copy()
@@ -130,12 +270,203 @@ def expand_geom(geom, factor):
     return geom
 ### END
 
+#---------------------------------------------------------------------------------------
+# STRAIN SWEEPS
+#---------------------------------------------------------------------------------------
+def strain_tensors(strains, mode="iso", s_dir=None):
+    """Deformation gradients F=I+eps (K,3,3) from an array of strains.
+
+    Mode of the strains:
+    - "iso": K scalars e, eps = e*I (same as expand_geom with factor 1+e);
+    - "uniaxial": K scalars e along direction s_dir, eps = e*s s^T (same as vector_lin_stretch with stretch 1+e);
+    - "tensor": K full 3x3 strain tensors eps.
+    """
+    strains = np.asarray(strains, dtype=float)
+    if mode == "iso":
+        eps = strains.reshape(-1)[:, None, None]*np.eye(3)
+    elif mode == "uniaxial":
+        if s_dir is None or not np.linalg.norm(s_dir):
+            raise ValueError("Uniaxial strain needs a direction")
+        s_dir = np.asarray(s_dir, dtype=float)/np.linalg.norm(s_dir)
+        eps = strains.reshape(-1)[:, None, None]*np.outer(s_dir, s_dir)
+    elif mode == "tensor":
+        eps = strains.reshape(-1, 3, 3)
+    else:
+        raise ValueError("Strain mode must be iso, uniaxial or tensor, not %s" % mode)
+    return np.eye(3) + eps
+
+@profiled
+def strain_sweep(geom, strains, mode="iso", s_dir=None, block=256):
+    """Generator of strained cells and positions of an ASE Atoms structure. Keeps relative coordinate fixed.
+
+    strains and mode as in strain_tensors. Yield (index, cell, positions) where cell is row-wise as in ASE.
+    All cells are computed with one batched matmul; positions in blocks of strains, to bound the memory."""
+
+    c_log = logger_setup(__name__)
+    cell = np.array(geom.get_cell())
+    if not np.any(cell):
+        c_log.error("Supercell is not defined")
+        raise ValueError
+
+    F = strain_tensors(strains, mode=mode, s_dir=s_dir)
+    # Each cell vector (row) is transformed as a_i -> F.a_i
+    cells = np.matmul(cell, np.transpose(F, (0, 2, 1))) # (K,3,3)
+    scaled = geom.get_scaled_positions(wrap=False)
+    c_log.debug("Strain sweep of %i structures", len(cells))
+    for s in range(0, len(cells), block):
+        pos = np.matmul(scaled, cells[s:s+block]) # (block,N,3)
+        for k, p in enumerate(pos):
+            yield s+k, cells[s+k], p
+
+@profiled
+def write_strain_sweep(geom, strains, fname_tmpl="POSCAR_%05i", fmt="vasp", mode="iso", s_dir=None, **kwargs):
+    """Write each structure of strain_sweep on disk, one file per strain.
+
+    The file name is fname_tmpl % index, fmt and kwargs are passed to ase.io.write. Return the list of files."""
+
+    import ase.io
+    conf = geom.copy() # One object for the whole sweep
+    fnames = []
+    for k, cell, pos in strain_sweep(geom, strains, mode=mode, s_dir=s_dir):
+        conf.set_cell(cell)
+        conf.positions = pos
+        fnames.append(fname_tmpl % k)
+        ase.io.write(fnames[-1], conf, format=fmt, **kwargs)
+    return fnames
+
+
+#---------------------------------------------------------------------------------------
+# INTERLAYER SLIDING SCANS
+#---------------------------------------------------------------------------------------
+def registry_grid(n_a, n_b=None):
+    """Regular grid of in-plane displacements, in fractional units of the first two cell vectors.
+
+    n_a (n_b, default n_a) points along a (b) in [0,1], extremes included. Return a (n_a*n_b,2) array."""
+    if n_b is None:
+        n_b = n_a
+    fa, fb = np.meshgrid(np.linspace(0, 1, n_a), np.linspace(0, 1, n_b), indexing='ij')
+    return np.c_[fa.ravel(), fb.ravel()]
+
+def reduce_registry_grid(grid, tol=1e-8):
+    """Remove displacements equivalent by a lattice translation from a fractional grid (K,2).
+
+    Return the unique displacements, mapped in [0,1), and the index of each original point in it,
+    so that the full landscape is recovered as values[inverse]."""
+    grid = np.atleast_2d(np.asarray(grid, dtype=float))
+    red = grid - np.floor(grid)
+    # Round to tolerance so that 1-eps and 0 are recognised as the same point
+    key = np.round(red/tol).astype(np.int64)
+    key[key == np.round(1/tol)] = 0
+    _, uniq, inverse = np.unique(key, axis=0, return_index=True, return_inverse=True)
+    return red[uniq], inverse.ravel()
+
+def registry_scan_points(grid, reduce=True):
+    """Fractional displacements visited by registry_scan, in its order, for the requested grid (K,2).
+
+    Return them and the (K,) index of each requested point among them: the landscape on the requested
+    grid is values[inverse], with values computed on the configurations yielded by registry_scan.
+    Without reduce, points are the grid itself and inverse is arange(K)."""
+    grid = np.atleast_2d(np.asarray(grid, dtype=float))
+    if reduce:
+        return reduce_registry_grid(grid)
+    return grid, np.arange(len(grid))
+
+@profiled
+def registry_scan(geom, z_cut, grid, reduce=True, block=64):
+    """Generator of the configurations of the top layer sliding over the bottom one.
+
+    The bilayer geom (ASE Atoms) is split at z_cut as in zcut_geom; the top layer is moved by each
+    in-plane displacement of grid (K,2, fractional units of the first two cell vectors) as in pbc_displ.
+    If reduce is True, displacements equivalent by a lattice translation are visited once (see reduce_registry_grid),
+    in sorted order: index then refers to the points of registry_scan_points(grid), whose inverse maps the results
+    back on the requested grid.
+
+    Yield (index, cartesian displacement, Atoms). The same Atoms object is updated in place at each step:
+    the bottom layer is never copied, copy the object if you need to keep it.
+    Displaced positions are computed in blocks of displacements, so memory does not grow with the grid."""
+
+    c_log = logger_setup(__name__)
+
+    grid, inverse = registry_scan_points(grid, reduce)
+    if reduce:
+        c_log.info("Registry grid reduced to %i unique points out of %i", len(grid), len(inverse))
+
+    top, bottom = zcut_geom(geom, z_cut)
+    z = geom.positions[:, -1]
+    is_top = z > z_cut
+    keep = is_top | (z < z_cut) # zcut_geom drops the atoms on the plane
+    # Offset removed by zcut_geom from the top layer positions
+    top_offset = np.r_[geom.cell[-1][:-1], z_cut]
+
+    conf = geom[keep] # One object for the whole scan, original order
+    top_idx = np.nonzero(is_top[keep])[0]
+    cell = np.array(geom.get_cell())
+    d_cart = np.dot(grid, cell[:2]) # Displacements along the in-plane cell vectors
+
+    for s in range(0, len(d_cart), block):
+        top_pos = pbc_displ_positions(top, d_cart[s:s+block]) + top_offset
+        for k, pos in enumerate(top_pos):
+            conf.positions[top_idx] = pos
+            yield s+k, d_cart[s+k], conf
+
+@profiled
+def write_registry_scan(geom, z_cut, grid, fname_tmpl="POSCAR_%05i", fmt="vasp", reduce=True, **kwargs):
+    """Write each configuration of registry_scan on disk, one file per displacement.
+
+    The file name is fname_tmpl % index, fmt and kwargs are passed to ase.io.write.
+    Return the list of written files, the displacements (cartesian, one per file) and the index of
+    the file of each point of grid (inverse of registry_scan_points): energies computed from the files
+    give the landscape on grid as energies[inverse]."""
+
+    import ase.io
+    fnames, displ = [], []
+    for k, d, conf in registry_scan(geom, z_cut, grid, reduce=reduce):
+        fnames.append(fname_tmpl % k)
+        displ.append(d.copy())
+        ase.io.write(fnames[-1], conf, format=fmt, **kwargs)
+    return fnames, np.array(displ), registry_scan_points(grid, reduce)[1]
+
 #---------------------------------------------------------------------------------------
 # EVALUATE A N-DIM PLANE AT A POINT R
 #---------------------------------------------------------------------------------------
+@profiled
 def plane_at_r(r, n, p):
     """Return the value of a n-dimensional plane at a given (n-1)-point.
 
     Takes as input the point of interest r (n-dim array), the normal to the plane (n-dim array) and a point intersect by the plane (n-dim array)
+    r can also be an array of points (one per row): an array of values is returned.
     """
-    return -sum([ni*(ri-pi) for ni, ri, pi in zip(n[:-1], r[:-1], p[:-1])])/n[-1]+p[-1]
+    r, n, p = np.asarray(r), np.asarray(n), np.asarray(p)
+    return -np.dot(r[..., :-1]-p[:-1], n[:-1])/n[-1]+p[-1]
+
+def plane_signed_distance(r, n, p):
+    """Signed distance of the points r (n-dim array or one per row) from the plane of normal n through p.
+
+    Positive on the side the normal points to."""
+    n = np.asarray(n, dtype=float)
+    return np.dot(np.asarray(r)-p, n)/np.linalg.norm(n)
+
+@profiled
+def plane_cut_masks(r, planes):
+    """Divide the points r (one per row) in the K+1 slabs defined by the K planes [(n1, p1), ...].
+
+    Normals are oriented upward (positive last component), so that a point is above a plane as in plane_at_r.
+    Planes should not cross each other inside the region of the points.
+    Signed distances from all the planes are computed in one pass. Return a list of K+1 boolean masks,
+    from the slab below all planes to the one above all of them."""
+    r = np.atleast_2d(np.asarray(r, dtype=float))
+    n = np.atleast_2d(np.asarray([pl[0] for pl in planes], dtype=float))
+    p = np.atleast_2d(np.asarray([pl[1] for pl in planes], dtype=float))
+    n = n*np.where(n[:, -1] < 0, -1., 1.)[:, None] # Upward normals
+    n = n/np.linalg.norm(n, axis=1)[:, None]
+    dist = np.dot(r, n.T) - np.einsum('ij,ij->i', n, p) # (N,K) signed distances
+    slab = np.count_nonzero(dist > 0, axis=1) # Number of planes below each point
+    return [slab == k for k in range(len(planes)+1)]
+
+@profiled
+def slab_cut(geom, planes):
+    """Cut an ASE Atoms structure in the K+1 slabs defined by the K planes [(n1, p1), ...].
+
+    See plane_cut_masks. Each slab keeps the cell, pbc, constraints and info of geom
+    (unlike zcut_geom, see atoms_subset). Return a list of Atoms from the bottom up."""
+    return [geom[m] for m in plane_cut_masks(geom.positions, planes)]
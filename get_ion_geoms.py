@@ -2,8 +2,10 @@
 
 import sys
 import os, argparse, logging
-from pymatgen.io.vasp import Vasprun
-from pymatgen.io.ase import AseAtomsAdaptor
+from useful_functions import lazy_import, enable_profiling
+# Heavy packages are imported only when needed
+pmg_vasp = lazy_import("pymatgen.io.vasp")
+pmg_ase = lazy_import("pymatgen.io.ase")
 
 def get_ion_geoms(argv):
     """"""
@@ -34,7 +36,9 @@ def get_ion_geoms(argv):
     logging.basicConfig(format=std_format)
     c_log.setLevel(logging.INFO)
     # Set debug option
-    if args.debug: c_log.setLevel(logging.DEBUG)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
 
     c_log.debug(args)
 
@@ -43,7 +47,7 @@ def get_ion_geoms(argv):
     #-------------------------------------------------------------------------------
 
     # Quickly load the xml, skip big parts to go faster
-    vasprun= Vasprun(args.filename,
+    vasprun= pmg_vasp.Vasprun(args.filename,
                      parse_projected_eigen=False,
                      parse_eigen=False,
                      parse_dos=False,
@@ -52,13 +56,13 @@ def get_ion_geoms(argv):
 
     #  Conver between PyMatGen Strcutre and ASE
     #  Just because we are more familiar with the latter
-    ase_bridge=AseAtomsAdaptor()
+    ase_bridge=pmg_ase.AseAtomsAdaptor()
 
     #  For each structure, save a POSCAR with the ion step in front (easier to read in right order from bash)
     for i, structure in enumerate(vasprun.structures):
         ase_bridge.get_atoms(structure).write("%i-ion_step.vasp" % i,
                                               vasp5=True)
-    return Vasprun.structures
+    return vasprun.structures
 
 # If executed as bash script, execute function and return exit status to bash
 if __name__ == "__main__":
@@ -2,8 +2,10 @@
 
 import sys
 import os, argparse, logging
-from ase.io import read
-from ase.spacegroup import get_spacegroup
+from useful_functions import lazy_import, enable_profiling
+# Heavy packages are imported only when needed
+ase_io = lazy_import("ase.io")
+ase_spacegroup = lazy_import("ase.spacegroup")
 
 def get_spgroup(argv):
     """Get spacegroup from list of files"""
@@ -36,7 +38,9 @@ def get_spgroup(argv):
     logging.basicConfig(format=std_format)
     c_log.setLevel(logging.INFO)
     # Set debug option
-    if args.debug: c_log.setLevel(logging.DEBUG)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
 
     c_log.debug(args)
 
@@ -44,7 +48,7 @@ def get_spgroup(argv):
     # Load geometry and print in cartesian
     #-------------------------------------------------------------------------------
 
-    spgroups = [get_spacegroup(read(filename), symprec=args.symprec) for filename in args.filenames]
+    spgroups = [ase_spacegroup.get_spacegroup(ase_io.read(filename), symprec=args.symprec) for filename in args.filenames]
 
     for f, spg in zip(args.filenames, spgroups):
         print("Geom %s Spacegroup symbol %s (%i)" % (f, spg.symbol, spg.no))
@@ -0,0 +1,158 @@
+# Cell-list (linked-cell) neighbor search for periodic structures
+"""
+--------------------------------
+ NEIGHBOR LIST
+--------------------------------
+
+Find all the atoms within a cutoff distance of each atom.
+
+Atoms are binned in fractional coordinates, so any triclinic cell works.
+The number of bins along each cell vector is chosen so that the width of a bin,
+measured perpendicular to the other two vectors, is at least the cutoff:
+only the neighboring bins must be searched and the cost scales linearly with N.
+
+The cell matrix follows the geometry module convention: cell vectors are the columns.
+The result is given in compact CSR-style arrays:
+ - offsets (N+1): neighbors of atom i are in the slice offsets[i]:offsets[i+1];
+ - neighbors: index j of the neighbor atom;
+ - shifts: integer cell shift S, the distance vector is r[j] - r[i] + U.S;
+ - distances: norm of the distance vector.
+
+Python 3 only.
+"""
+
+import numpy as np
+from useful_functions import logger_setup, profiled
+from geometry import as_cell
+
+def _bin_setup(frac, pbc, r_cut, plane_dist):
+    """Return bin index along each axis, number of bins, and search range of each axis."""
+
+    n_at, dim = frac.shape
+    bins = np.empty((n_at, dim), dtype=np.int64)
+    n_bins = np.empty(dim, dtype=np.int64)
+    n_search = np.empty(dim, dtype=np.int64)
+    for a in range(dim):
+        if pbc[a]:
+            # Fractional coordinates already wrapped in [0,1)
+            f0, extent = 0., 1.
+        else:
+            # Bin only the region occupied by the atoms
+            f0, extent = frac[:, a].min(), np.ptp(frac[:, a])
+        width = extent*plane_dist[a] # Perpendicular width of the region
+        n_bins[a] = max(1, int(width // r_cut))
+        if width > 0:
+            bins[:, a] = np.floor((frac[:, a]-f0)/extent*n_bins[a]).astype(np.int64)
+        else:
+            bins[:, a] = 0
+        np.clip(bins[:, a], 0, n_bins[a]-1, out=bins[:, a])
+        # How many bins must be visited to cover r_cut. Not more than the images/bins available.
+        n_search[a] = int(np.ceil(r_cut*n_bins[a]/width)) if width > 0 else 0
+        if not pbc[a]:
+            n_search[a] = min(n_search[a], n_bins[a]-1)
+    return bins, n_bins, n_search
+
+@profiled
+def neighbor_list(positions, U, r_cut, pbc=True, self_interaction=False):
+    """Neighbors closer than r_cut to each atom with a cell-list algorithm.
+
+    Positions is a (N,dim) array, U the cell with vectors as columns (or a geometry.Cell), pbc a bool or a bool per cell vector.
+    Return the CSR-style tuple (offsets, neighbors, shifts, distances), see module doc.
+    Each pair is listed twice, i.e. j is a neighbor of i and i is a neighbor of j.
+    If self_interaction is False, an atom is not its own neighbor (its periodic images are)."""
+
+    c_log = logger_setup(__name__)
+
+    positions = np.atleast_2d(np.asarray(positions, dtype=float))
+    cell = as_cell(U)
+    U, Uinv = cell.matrix, cell.inv
+    n_at, dim = positions.shape
+    if U.shape != (dim, dim):
+        raise ValueError("Cell and positions must have the same dimension")
+    if r_cut <= 0:
+        raise ValueError("Cutoff must be positive")
+    pbc = np.broadcast_to(np.asarray(pbc, dtype=bool), (dim,))
+    # Distance between lattice planes is 1/|reciprocal vector|
+    plane_dist = 1./np.linalg.norm(Uinv, axis=1)
+
+    # Fractional coordinates, wrapped along periodic directions.
+    # Keep track of the wrapping as an integer shift of each atom.
+    frac = np.dot(positions, Uinv.T)
+    wrap = np.where(pbc, -np.floor(frac), 0.).astype(np.int64)
+    frac = frac + wrap
+    frac[:, pbc] %= 1. # Rounding can leave exactly 1.0
+    wrapped = np.dot(frac, U.T)
+
+    bins, n_bins, n_search = _bin_setup(frac, pbc, r_cut, plane_dist)
+    c_log.debug("Bins per axis %s, search range %s", n_bins, n_search)
+
+    # Linked-cell as sorted array: atoms of bin b are order[start[b]:start[b]+count[b]]
+    strides = np.cumprod(np.r_[1, n_bins[:0:-1]])[::-1]
+    lin = np.dot(bins, strides)
+    order = np.argsort(lin, kind='stable')
+    count = np.bincount(lin, minlength=np.prod(n_bins))
+    start = np.r_[0, np.cumsum(count)[:-1]]
+
+    r2_cut = r_cut**2
+    res_i, res_j, res_s, res_d = [], [], [], []
+    # Loop over the relative bin offsets, vectorized over all the atoms
+    for o in np.ndindex(*(2*n_search+1)):
+        o = np.asarray(o) - n_search
+        nb = bins + o
+        img = np.floor_divide(nb, n_bins)
+        valid = np.all(pbc | (img == 0), axis=1)
+        nb -= img*n_bins
+        i_at = np.nonzero(valid)[0]
+        nb_lin = np.dot(nb[i_at], strides)
+        n_cand = count[nb_lin]
+        tot = n_cand.sum()
+        if tot == 0:
+            continue
+        # Expand each atom i into the list of atoms of its neighbor bin
+        i_rep = np.repeat(i_at, n_cand)
+        first = np.repeat(start[nb_lin] - np.cumsum(n_cand) + n_cand, n_cand)
+        j_rep = order[first + np.arange(tot)]
+        img_rep = img[i_rep]
+        dvec = wrapped[j_rep] - wrapped[i_rep] + np.dot(img_rep, U.T)
+        d2 = np.einsum('ij,ij->i', dvec, dvec)
+        keep = d2 < r2_cut
+        if not self_interaction:
+            keep &= ~((i_rep == j_rep) & np.all(img_rep == 0, axis=1))
+        i_rep, j_rep = i_rep[keep], j_rep[keep]
+        res_i.append(i_rep)
+        res_j.append(j_rep)
+        # Shift with respect to the original, unwrapped positions
+        res_s.append(img_rep[keep] + wrap[j_rep] - wrap[i_rep])
+        res_d.append(np.sqrt(d2[keep]))
+
+    if not res_i:
+        return (np.zeros(n_at+1, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros((0, dim), dtype=np.int64), np.zeros(0))
+
+    # Sort by first atom: CSR layout
+    i_all = np.concatenate(res_i)
+    srt = np.argsort(i_all, kind='stable')
+    offsets = np.r_[0, np.cumsum(np.bincount(i_all, minlength=n_at))]
+    neighbors = np.concatenate(res_j)[srt]
+    shifts = np.concatenate(res_s)[srt]
+    distances = np.concatenate(res_d)[srt]
+    return offsets, neighbors, shifts, distances
+
+@profiled
+def atoms_neighbor_list(atoms, r_cut, self_interaction=False):
+    """Neighbor list of an ASE Atoms object. Cell and pbc are taken from the object.
+
+    Return the same CSR-style tuple of neighbor_list."""
+
+    c_log = logger_setup(__name__)
+    pbc = atoms.get_pbc()
+    cell = np.array(atoms.get_cell())
+    if abs(np.linalg.det(cell)) < 1e-12:
+        if pbc.any():
+            c_log.error("Periodic system needs a well-defined cell")
+            raise ValueError("Degenerate cell")
+        # Isolated system: any box will do, periodicity is off
+        cell = np.eye(3)*max(1., np.ptp(atoms.positions, axis=0).max())
+    # ASE cell is row-wise
+    return neighbor_list(atoms.positions, cell.T, r_cut, pbc=pbc,
+                         self_interaction=self_interaction)
@@ -1,69 +1,297 @@
 #!/usr/bin/env python3
-import collections
+import bisect
+import collections.abc
 
-class OrderedSet(collections.MutableSet):
+class OrderedSet(collections.abc.MutableSet):
+    """Set that remembers insertion order.
+
+    Keys are stored in an insertion-ordered dict (values unused): no per-element linked-list nodes.
+    Bulk operations (update, union, intersection, difference) work on whole iterables at once."""
+
+    __slots__ = ('_map',)
 
     def __init__(self, iterable=None):
-        self.end = end = [] 
-        end += [None, end, end]         # sentinel node for doubly linked list
-        self.map = {}                   # key --> [key, prev, next]
-        if iterable is not None:
-            self |= iterable
+        self._map = dict.fromkeys(iterable) if iterable is not None else {}
+
+    @classmethod
+    def _from_map(cls, key_map):
+        new = cls.__new__(cls)
+        new._map = key_map
+        return new
 
     def __len__(self):
-        return len(self.map)
+        return len(self._map)
 
     def __contains__(self, key):
-        return key in self.map
+        return key in self._map
 
     def add(self, key):
-        if key not in self.map:
-            end = self.end
-            curr = end[1]
-            curr[2] = end[1] = self.map[key] = [key, curr, end]
+        self._map[key] = None
 
     def discard(self, key):
-        if key in self.map:        
-            key, prev, next = self.map.pop(key)
-            prev[2] = next
-            next[1] = prev
+        self._map.pop(key, None)
 
     def __iter__(self):
-        end = self.end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[2]
+        return iter(self._map)
 
     def __reversed__(self):
-        end = self.end
-        curr = end[1]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[1]
+        return reversed(self._map)
 
     def pop(self, last=True):
         if not self:
             raise KeyError('set is empty')
-        key = self.end[1][0] if last else self.end[2][0]
+        if last:
+            return self._map.popitem()[0]
+        key = next(iter(self._map))
+        del self._map[key]
+        return key
+
+    def copy(self):
+        return self._from_map(self._map.copy())
+
+    def clear(self):
+        self._map.clear()
+
+    #---------------------------------------------------------------------------
+    # Bulk set algebra. Order: elements of self first, then new ones from others.
+    #---------------------------------------------------------------------------
+    def update(self, *others):
+        for other in others:
+            self._map.update(dict.fromkeys(other))
+
+    def union(self, *others):
+        new = self.copy()
+        new.update(*others)
+        return new
+
+    def intersection(self, *others):
+        keys = self._map.keys()
+        for other in others:
+            keys = keys & set(other)
+        return self._from_map({k: None for k in self._map if k in keys})
+
+    def difference(self, *others):
+        drop = set().union(*others)
+        return self._from_map({k: None for k in self._map if k not in drop})
+
+    def symmetric_difference(self, other):
+        other = OrderedSet(other)
+        return self._from_map({k: None for k in self._map if k not in other._map}
+                              | {k: None for k in other._map if k not in self._map})
+
+    def intersection_update(self, *others):
+        self._map = self.intersection(*others)._map
+
+    def difference_update(self, *others):
+        self._map = self.difference(*others)._map
+
+    def __or__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return self.union(other)
+
+    def __and__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return self.difference(other)
+
+    def __xor__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return self.symmetric_difference(other)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __repr__(self):
+        if not self:
+            return '%s()' % (self.__class__.__name__,)
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (OrderedSet, IndexedOrderedSet)):
+            return len(self) == len(other) and list(self) == list(other)
+        return set(self) == set(other)
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return list(self._map)
+
+    def __setstate__(self, state):
+        self._map = dict.fromkeys(state)
+
+
+_DEAD = object() # Tombstone of removed keys in IndexedOrderedSet
+
+class IndexedOrderedSet(collections.abc.MutableSet):
+    """Set that remembers insertion order, with positional access: s[i], s[a:b], s.index(x), s.pop(i).
+
+    Keys are stored in a list, plus a dict key --> position in the list.
+    Removed keys leave a tombstone: removal from the head or the tail is O(1), positions of the
+    tombstones in the middle are kept in a sorted list and skipped by bisection (O(log n)).
+    The list is compacted when tombstones outnumber the keys, so costs are amortized.
+    Iteration order, equality and pop(last) are the same as OrderedSet; pop also takes a position."""
+
+    __slots__ = ('_keys', '_index', '_head', '_holes')
+
+    def __init__(self, iterable=None):
+        self._keys, self._index = [], {}
+        self._head = 0   # Tombstones at the beginning of the list
+        self._holes = [] # Sorted positions of the tombstones after the head
+        if iterable is not None:
+            self.update(iterable)
+
+    def _compact(self):
+        self._keys = [k for k in self._keys[self._head:] if k is not _DEAD]
+        self._index = {k: i for i, k in enumerate(self._keys)}
+        self._head, self._holes = 0, []
+
+    def _position(self, i):
+        """List position of the i-th key (0 <= i < len)"""
+        holes, target = self._holes, self._head+i
+        # Count the holes before it: hole j precedes the key if holes[j]-j <= head+i
+        lo, hi = 0, len(holes)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if holes[mid]-mid <= target:
+                lo = mid+1
+            else:
+                hi = mid
+        return target+lo
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def add(self, key):
+        if key not in self._index:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+
+    def update(self, *others):
+        for other in others:
+            for key in other:
+                self.add(key)
+
+    def discard(self, key):
+        pos = self._index.pop(key, None)
+        if pos is None:
+            return
+        keys, holes = self._keys, self._holes
+        if not self._index:
+            self.clear()
+            return
+        if pos == len(keys)-1:
+            # Tail: drop it and the tombstones before it
+            keys.pop()
+            while keys[-1] is _DEAD:
+                keys.pop()
+                holes.pop()
+        elif pos == self._head:
+            # Head: move the head forward, over the tombstones too
+            keys[pos] = _DEAD
+            n_skip = 0
+            self._head += 1
+            while keys[self._head] is _DEAD:
+                self._head += 1
+                n_skip += 1
+            del holes[:n_skip]
+        else:
+            keys[pos] = _DEAD
+            bisect.insort(holes, pos)
+        if self._head+len(holes) > len(self._index):
+            self._compact()
+
+    def __iter__(self):
+        keys = self._keys
+        if self._holes:
+            return (k for k in keys[self._head:] if k is not _DEAD)
+        return iter(keys[self._head:]) if self._head else iter(keys)
+
+    def __reversed__(self):
+        return (k for k in reversed(self._keys[self._head:]) if k is not _DEAD)
+
+    def __getitem__(self, i):
+        n = len(self._index)
+        if isinstance(i, slice):
+            return self.__class__(self[j] for j in range(*i.indices(n)))
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('index out of range')
+        if not self._holes:
+            return self._keys[self._head+i]
+        return self._keys[self._position(i)]
+
+    def index(self, key):
+        """Position of key in the set"""
+        try:
+            pos = self._index[key]
+        except KeyError:
+            raise ValueError('%r is not in set' % (key,))
+        return pos - self._head - bisect.bisect_left(self._holes, pos)
+
+    def pop(self, i=-1, *, last=None):
+        """Remove and return the key at position i (default last).
+
+        As in OrderedSet.pop, last=True/False removes the last/first key: a bool i is taken as last,
+        so s.pop(True) is s.pop(-1) and s.pop(False) is s.pop(0), not s.pop(1) and s.pop(0)."""
+        if isinstance(i, bool):
+            last = i
+        if last is not None:
+            i = -1 if last else 0
+        if not self:
+            raise KeyError('set is empty')
+        key = self[i]
         self.discard(key)
         return key
 
+    def clear(self):
+        self._keys, self._index = [], {}
+        self._head, self._holes = 0, []
+
+    def copy(self):
+        return self.__class__(self)
+
     def __repr__(self):
         if not self:
             return '%s()' % (self.__class__.__name__,)
         return '%s(%r)' % (self.__class__.__name__, list(self))
 
     def __eq__(self, other):
-        if isinstance(other, OrderedSet):
+        if isinstance(other, (OrderedSet, IndexedOrderedSet)):
             return len(self) == len(other) and list(self) == list(other)
         return set(self) == set(other)
 
-            
+    __hash__ = None
+
+    def __getstate__(self):
+        return list(self)
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+
 if __name__ == '__main__':
     s = OrderedSet('abracadaba')
     t = OrderedSet('simsalabim')
     print(s | t)
     print(s & t)
     print(s - t)
-
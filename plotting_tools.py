@@ -1,4 +1,5 @@
 import numpy as np
+from useful_functions import profiled
 
 # Shortcut to get xs and ys of list of vect.
 # Useful for scatterplots.
@@ -8,6 +9,7 @@ def get_y(l):
     return np.stack(l, axis=-1)[1,:]
 
 # A function to plot vectors in 2D
+@profiled
 def plot_v_2d(ax, v_origin, v_vector,
               v_color,
               v_width=0.005, nohead=False, offset=2,
@@ -2,17 +2,16 @@
 
 import sys
 import os, argparse, logging
-import ase.io
-from ase.build import sort as ase_sort
-from ase.io import read as ase_read
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import numpy as np
-from mpl_toolkits.mplot3d import Axes3D
-
-o = np.array([0, 0, 0])
+from useful_functions import lazy_import, profiled, enable_profiling
+# Heavy packages are imported only when needed
+ase = lazy_import("ase")
+ase_io = lazy_import("ase.io")
+ase_build = lazy_import("ase.build")
+plt = lazy_import("matplotlib.pyplot")
+np = lazy_import("numpy")
 
 
+@profiled
 def plot_displ(ax, start, end,
                atm_scale=1, v_len=1, normalize=False, plt_uc=False, plt_endpt=False, mindisp=0.0):
     """Plot displacement field between two given geometries.
@@ -27,6 +26,7 @@ def plot_displ(ax, start, end,
     if False in [isinstance(start, ase.Atoms), isinstance(end, ase.Atoms)]:
         raise TypeError("Start and end geometry need to be ASE Atoms obj")
 
+    o = np.array([0, 0, 0]) # Origin
     p0 = start.positions
     p1 = end.positions
     dp = p1 - p0
@@ -163,7 +163,9 @@ def plot_displ_CLI(argv):
     logging.basicConfig(format=std_format)
     c_log.setLevel(logging.INFO)
     # Set debug option
-    if args.debug: c_log.setLevel(logging.DEBUG)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
 
     c_log.debug(args)
 
@@ -171,23 +173,24 @@ def plot_displ_CLI(argv):
     # Load geometry
     # -------------------------------------------------------------------------------
 
-    start = ase_read(args.start)
+    start = ase_io.read(args.start)
     del start.constraints
     try:
-        start = ase_sort(start * args.replica)
+        start = ase_build.sort(start * args.replica)
     except Exception as e:
         c_log.error("Starting geom replication went wrong. Expect errors")
 
-    end = ase_read(args.end)
+    end = ase_io.read(args.end)
     del end.constraints
     try:
-        end = ase_sort(end * args.replica)
+        end = ase_build.sort(end * args.replica)
     except Exception as e:
         c_log.error("Ending geom replication went wrong. Expect errors")
 
     # -------------------------------------------------------------------------------
     # Plot
     # -------------------------------------------------------------------------------
+    from mpl_toolkits.mplot3d import Axes3D # Register 3d projection
     fig = plt.figure()
     fig.set_dpi(150)
     ax = fig.gca(projection='3d')
@@ -1,7 +1,81 @@
 #!/usr/bin/env python3
 
-import sys, logging, argparse, io
-from useful_functions import logger_setup, load_stream, adjust_col_width
+import sys, logging, argparse, io, tempfile, shutil, itertools
+from useful_functions import logger_setup, enable_profiling, load_stream, adjust_col_width, iter_stream, COMMENT, ColumnFormatter, \
+                             open_stream, COMPRESSIONS
+
+def _iter_chunks(stream, comment_char, chunk_lines=2**15):
+    """Read stream in chunks of lines. Yield (first line number, stripped lines, data rows or None).
+
+    Data rows (split fields) are given only if the chunk has no comments, i.e. it can be formatted in one go."""
+    line_no = 0
+    while True:
+        lines = [l.strip() for l in itertools.islice(stream, chunk_lines)]
+        if not lines:
+            return
+        lines = [l for l in lines if l] if "" in lines else lines
+        if comment_char is not None and any(l[0] == comment_char for l in lines):
+            yield line_no, lines, None
+        else:
+            yield line_no, lines, [l.split() for l in lines]
+        line_no += chunk_lines
+
+def pretty_columns_stream(in_stream, out_stream, comment_char="#", split=False, offset=5):
+    """Adjust the width of data lines of in_stream and write them on out_stream, in constant memory.
+
+    Same output of adjust_col_width, in two passes: first only the max width of each column is computed,
+    then each line is formatted and written. Non-seekable input (e.g. stdin) is spooled to a temporary file.
+    If split is True comments are written first (one more pass).
+    Lines are processed in chunks: memory depends on the chunk and number of columns, not on the file size."""
+
+    c_log = logger_setup(__name__)
+
+    # Spool pipes to disk: we need to read the input twice
+    if not in_stream.seekable():
+        c_log.debug("Spooling input to temporary file")
+        spool = tempfile.TemporaryFile(mode='w+')
+        shutil.copyfileobj(in_stream, spool)
+        in_stream = spool
+    in_stream.seek(0)
+
+    #++++++++ FIRST PASS ++++++++++ Column widths
+    cols_w = None
+    for _, lines, rows in _iter_chunks(in_stream, comment_char):
+        if rows is None:
+            rows = [l.split() for l in lines if l[0] != comment_char]
+        if not rows:
+            continue
+        if cols_w is None:
+            cols_w = [0]*len(rows[0])
+        if set(map(len, rows)) != {len(cols_w)}:
+            raise ValueError("All lines must have same length")
+        cols_w = [max(w, max(map(len, col))) for w, col in zip(cols_w, zip(*rows))]
+    c_log.debug("Column widths %s", cols_w)
+
+    # Same format of adjust_col_width, compiled once
+    fmt = ColumnFormatter([w+offset for w in cols_w or []])
+
+    #++++++++ SECOND PASS ++++++++++ Format and write
+    if split:
+        # Comments first, with their line number. Need the exact line numbers here.
+        in_stream.seek(0)
+        for i, kind, fields in iter_stream(in_stream, comment_char=comment_char):
+            if kind == COMMENT:
+                out_stream.write((comment_char+"%i:"%i) + fields[1:].strip() + "\n")
+    in_stream.seek(0)
+    for _, lines, rows in _iter_chunks(in_stream, comment_char):
+        if rows is not None:
+            # Fast path: only data in this chunk
+            fmt.write(rows, out_stream)
+            continue
+        out = []
+        for l in lines:
+            if l[0] == comment_char:
+                if not split:
+                    out.append(l+"\n")
+            else:
+                out.append(fmt.format_row(l.split())+"\n")
+        out_stream.write("".join(out))
 
 def pretty_columns(argv):
     """Adjust the width of data lines in given file or stdin.
@@ -9,7 +83,9 @@ def pretty_columns(argv):
     Comment lines are start with given comment character.
     Comments can be grouped at the top or left at original position.
 
-    Return stringIO with output (Python func) or prints on stdout (bash script)."""
+    Return stringIO with output (Python func) or prints on stdout (bash script).
+    With --stream the output is written directly on stdout, with memory independent of the file size.
+    Input can be gzip, bz2 or xz compressed."""
 
     #-------------------------------------------------------------------------------
     # Argument parser
@@ -29,6 +105,15 @@ def pretty_columns(argv):
     parser.add_argument('--split',
                         action='store_true', dest='split_flg',
                         help='put comments at beginning of file;')
+    parser.add_argument('--stream',
+                        action='store_true', dest='stream_flg',
+                        help='two-pass, constant-memory mode: write directly on stdout;')
+    parser.add_argument('-z', '--compress',
+                        dest='compress', default=None, choices=COMPRESSIONS,
+                        help='compress output (only with --stream);')
+    parser.add_argument('--level',
+                        dest='level', type=int, default=None,
+                        help='compression level (default of the compression module);')
     parser.add_argument('--debug',
                         action='store_true', dest='debug',
                         help='show debug information.')
@@ -37,6 +122,8 @@ def pretty_columns(argv):
     # Initialize and check variables
     #-------------------------------------------------------------------------------
     args = parser.parse_args(argv) # Process arguments
+    if args.compress and not args.stream_flg:
+        parser.error("--compress requires --stream")
 
     # Set up logger and debug options
     c_log = logger_setup(__name__)
@@ -45,16 +132,29 @@ def pretty_columns(argv):
     if args.debug:
         c_log.setLevel(logging.DEBUG)
         debug_opt = ['-d']
+        enable_profiling() # Report timings at exit
     c_log.debug(args)
 
-    # Initialize input stream
-    if args.filename is None:
-        in_stream = sys.stdin
-    else:
-        in_stream = open(args.filename, 'r')
+    # Initialize input stream, decompressing it if needed
+    in_stream = open_stream(args.filename)
 
     if args.comment_c == "-1": args.comment_c = None
 
+    #-------------------------------------------------------------------------------
+    # Streaming mode: write directly on stdout
+    #-------------------------------------------------------------------------------
+    if args.stream_flg:
+        c_log.debug("Streaming")
+        if args.compress:
+            with open_stream(None, 'w', compression=args.compress, level=args.level) as out_stream:
+                pretty_columns_stream(in_stream, out_stream, comment_char=args.comment_c,
+                                      split=args.split_flg)
+        else:
+            pretty_columns_stream(in_stream, sys.stdout, comment_char=args.comment_c,
+                                  split=args.split_flg)
+        in_stream.close()
+        return None
+
     #-------------------------------------------------------------------------------
     # Initialise output string stream
     #-------------------------------------------------------------------------------
@@ -78,6 +178,7 @@ def pretty_columns(argv):
                                   split=False)
         c_log.debug(c_num)
         c_log.debug("Comments at "+"%i "*len(c_num), *c_num)
+        c_num = set(c_num) # Fast lookup
         # Adjust only data lines
         data_adj = adjust_col_width([l for i, l in enumerate(data)
                                      if i not in c_num] )
@@ -93,10 +194,12 @@ def pretty_columns(argv):
     #-------------------------------------------------------------------------------
     # Close input and return output string stream
     #-------------------------------------------------------------------------------
-    if args.filename: in_stream.close()
+    in_stream.close()
     return output
 
 # If executed as bash script, execute function and print results
 if __name__ == "__main__":
     # Last newling already included
-    print(pretty_columns(sys.argv[1:]).getvalue(), end="")
+    output = pretty_columns(sys.argv[1:])
+    if output is not None:
+        print(output.getvalue(), end="")
@@ -5,31 +5,28 @@
 ################################################################################
 # Preliminaries
 ################################################################################
-import sys, argparse, logging
-import numpy as np
-from numpy import c_, r_
-import ase.io
-from ase import Atoms
-from useful_functions import logger_setup
-from geometry import plane_at_r
+import sys, argparse, logging, io
+from useful_functions import logger_setup, enable_profiling, lazy_import, open_stream, file_compression, strip_compression_ext
+# Heavy packages are imported only when needed
+np = lazy_import("numpy")
+ase_io = lazy_import("ase.io")
+geometry = lazy_import("geometry")
 
 def geom_plane_cut(geom, n, p):
-    """Return atoms in ASE structure (geom) above and below (tuple of Atoms object) the plane defined by the normal n and intercept p"""
+    """Return atoms in ASE structure (geom) above and below (tuple of Atoms object) the plane defined by the normal n and intercept p.
+
+    Both keep the cell of geom, with pbc False and no constraints (see geometry.atoms_subset)."""
 
     c_log = logger_setup(__name__)
     
     #-------------------------------------------------------------------------------
     # Divede the points 
     #-------------------------------------------------------------------------------
-    p_up, p_down = [], []
-    for i, pi in enumerate(geom.positions):
-        if pi[-1] > plane_at_r(pi, n, p):
-            p_up.append(geom[i])
-        else:
-            p_down.append(geom[i])
-    p_up = Atoms(p_up)
+    # One pass over all the positions, then boolean indexing of the Atoms obj
+    m_down, m_up = geometry.plane_cut_masks(geom.positions, [(n, p)])
+    p_up = geometry.atoms_subset(geom, m_up)
     p_up.set_cell(geom.get_cell())
-    p_down = Atoms(p_down)
+    p_down = geometry.atoms_subset(geom, m_down)
     p_down.set_cell(geom.get_cell())
     c_log.debug("Up and down")
     c_log.debug(p_up)
@@ -43,7 +40,8 @@ def geom_plane_cut(geom, n, p):
 def plane_cut_wrap(argv):
     """Cut a structure according to given plane
 
-    Valid ASE input geometry from filename or stdin. Plane defined by normal vector n and intercept p.
+    Valid ASE input geometry from filename or stdin, possibly gzip, bz2 or xz compressed.
+    Plane defined by normal vector n and intercept p.
     Returns a ASE atoms object with the atoms below (or above) the plane.
     If used as script prints an xyz file."""
 
@@ -90,14 +88,24 @@ def plane_cut_wrap(argv):
     if args.debug:
         c_log.setLevel(logging.DEBUG)
         debug_opt = ['-d']
+        enable_profiling() # Report timings at exit
     c_log.debug(args)
 
     # Load data from the right source
     # FIXME: there is something broken here. Gets broken pipe.
     if args.filename is None:
-        geom = ase.io.read(sys.stdin) #, format="xyz")
+        # Decompressed in memory: ASE needs seekable bytes to guess the format
+        with open_stream(None, 'rb') as in_stream:
+            data = in_stream.read()
+        in_format = ase_io.formats.filetype(io.BytesIO(data))
+        geom = ase_io.read(io.StringIO(data.decode()), format=in_format) #, format="xyz")
+    elif file_compression(args.filename) is not None:
+        # Format from the name without the compression extension, whatever the compression
+        in_format = ase_io.formats.filetype(strip_compression_ext(args.filename), read=False)
+        with open_stream(args.filename) as in_stream:
+            geom = ase_io.read(in_stream, format=in_format)
     else:
-        geom = ase.io.read(args.filename) # , format="xyz")
+        geom = ase_io.read(args.filename) # , format="xyz")
 
     # Define the plane
     n = np.array(args.normal)
@@ -153,7 +161,7 @@ def plane_cut_wrap(argv):
         res = p_down
 
     if __name__ == "__main__":
-        ase.io.write('-', res, format=args.format)
+        ase_io.write('-', res, format=args.format)
 
     return res
 ### End function ---------------------------------------------------------------
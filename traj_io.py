@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+
+"""Streaming readers of MD trajectory files.
+
+Frames are parsed one at a time into reused NumPy buffers: memory does not depend on the trajectory length.
+Cells are given as in the files and in ASE, with the cell vectors as ROWS: pass cell.T to geometry functions.
+
+Uncompressed XDATCAR and xyz files can be indexed (byte offset of each frame, see frame_index),
+so that slices of frames are read seeking straight to them.
+Trajectories can be converted to a binary directory format (TrajWriter), opened as memory maps (MemmapTrajectory)."""
+
+################################################################################
+# Preliminaries
+################################################################################
+import os, io, re, mmap
+import numpy as np
+from useful_functions import logger_setup, profiled, open_stream
+
+#-------------------------------------------------------------------------------
+# Frame index
+#-------------------------------------------------------------------------------
+# Lines starting a frame: configuration line of XDATCAR, atom number line of xyz
+_XDATCAR_CONFIG = re.compile(rb"^[ \t]*[Dd]irect[^\n]*\n", re.M)
+_XYZ_COUNT = re.compile(rb"^[ \t]*\d+[ \t]*\r?\n", re.M)
+
+def _index_path(filename):
+    """Path of the sidecar index file of filename"""
+    return filename + ".index.npz"
+
+def _line_back(buf, pos, n_lines):
+    """Start of the line n_lines lines before the one starting at pos"""
+    for _ in range(n_lines):
+        pos = buf.rfind(b"\n", 0, pos-1) + 1
+    return pos
+
+def _line_forward(buf, pos, n_lines):
+    """Start of the line n_lines lines after the one starting at pos"""
+    for _ in range(n_lines):
+        pos = buf.find(b"\n", pos) + 1
+    return pos
+
+def _scan_xdatcar(buf):
+    """Byte offsets of the frames of XDATCAR in buffer buf.
+
+    Fixed cell: offset of the configuration lines. Variable cell: offset of the title line of each header."""
+    configs = [m.start() for m in _XDATCAR_CONFIG.finditer(buf)]
+    if len(configs) < 2:
+        return np.array(configs[:1], dtype=np.int64)
+    # Lines of the header before the configuration line: 7, or 6 without species (VASP 4)
+    n_head = buf[:configs[0]].count(b"\n")
+    # Fixed cell if the line after the coordinates of frame 0 is a configuration line,
+    # otherwise a new header. Number of atoms from the counts line, just before the first one.
+    counts_start = _line_back(buf, configs[0], 1)
+    n_atoms = sum(int(x) for x in buf[counts_start:configs[0]].split())
+    if _line_forward(buf, configs[0], n_atoms+1) == configs[1]:
+        return np.array(configs, dtype=np.int64)
+    return np.array([0]+[_line_back(buf, c, n_head) for c in configs[1:]], dtype=np.int64)
+
+def _scan_xyz(buf):
+    """Byte offsets of the frames of xyz file in buffer buf"""
+    offsets, end = [], -1
+    for m in _XYZ_COUNT.finditer(buf):
+        if m.start() == end: # Comment line made of a number only
+            continue
+        offsets.append(m.start())
+        end = m.end()
+    return np.array(offsets, dtype=np.int64)
+
+_SCANNERS = {"xdatcar": _scan_xdatcar, "xyz": _scan_xyz}
+
+def _guess_format(buf):
+    return "xyz" if _XYZ_COUNT.match(buf) else "xdatcar"
+
+@profiled
+def frame_index(filename, fmt=None, save=True):
+    """Byte offsets (int64 array) of the frames of uncompressed XDATCAR or xyz file.
+
+    fmt is "xdatcar" or "xyz", guessed from the first line if None.
+    The file is scanned once and the offsets are saved in the sidecar file <filename>.index.npz,
+    valid as long as the file size and modification time do not change."""
+    c_log = logger_setup(__name__)
+    st = os.stat(filename)
+    idx_path = _index_path(filename)
+    try:
+        with np.load(idx_path) as idx:
+            if (int(idx["size"]), int(idx["mtime_ns"])) == (st.st_size, st.st_mtime_ns) and \
+               (fmt is None or str(idx["fmt"]) == fmt):
+                return idx["offsets"]
+    except (OSError, ValueError, KeyError):
+        pass # Missing, stale or broken index: scan again
+
+    if st.st_size == 0:
+        return np.zeros(0, dtype=np.int64)
+    with open(filename, 'rb') as in_file, \
+         mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if fmt is None:
+            fmt = _guess_format(buf)
+        if fmt not in _SCANNERS:
+            raise ValueError("Unknown trajectory format %r, use one of %s" % (fmt, list(_SCANNERS)))
+        offsets = _SCANNERS[fmt](buf)
+    c_log.debug("%s: %i frames indexed", filename, len(offsets))
+
+    if save:
+        # Write to temporary file and move, so a reader never sees half an index
+        try:
+            with open(idx_path+".tmp", 'wb') as idx_file:
+                np.savez(idx_file, offsets=offsets, size=st.st_size, mtime_ns=st.st_mtime_ns, fmt=fmt)
+            os.replace(idx_path+".tmp", idx_path)
+        except OSError as err:
+            c_log.debug("Index not saved: %s", err)
+    return offsets
+
+def _frame_range(n_frames, start, stop, step):
+    return range(n_frames)[slice(start, stop, step)]
+
+#-------------------------------------------------------------------------------
+# VASP XDATCAR
+#-------------------------------------------------------------------------------
+def _parse_cell(scale_line, vec_lines):
+    """Cell (vectors as rows) from the scale line and the three lattice vector lines of a VASP header"""
+    cell = np.array(b" ".join(vec_lines).split(), dtype=float).reshape(3, 3)
+    scale = float(scale_line)
+    if scale < 0: # Negative scale is the volume
+        scale = (-scale/abs(np.linalg.det(cell)))**(1/3)
+    return cell*scale
+
+def _is_config(line):
+    return line.lstrip().lower().startswith(b"direct")
+
+class Xdatcar:
+    """Streaming reader of VASP XDATCAR files, fixed or variable cell, possibly compressed.
+
+    The header (cell, species, counts) is read at opening.
+    Attributes: title, species, counts, symbols (one per atom), n_atoms, cell (first frame), variable_cell.
+    Iterate over frames() to get the frames one at a time.
+
+    Use as a context manager, or call close()."""
+
+    def __init__(self, filename="XDATCAR"):
+        self.filename = filename
+        self._stream = open_stream(filename, 'rb')
+        self.variable_cell = None # Known after the first frame
+        self._read_header(self._stream.readline())
+
+    def _read_header(self, title):
+        """Read the header after its title line, up to the first configuration line"""
+        stream = self._stream
+        self.title = title.decode().strip()
+        self.cell = _parse_cell(stream.readline(), [stream.readline() for _ in range(3)])
+        line = stream.readline()
+        try:
+            counts = [int(x) for x in line.split()]
+            species = self.title.split() # VASP 4: no species line, try the title
+        except ValueError:
+            species = line.decode().split()
+            counts_line = stream.readline()
+            counts = [int(x) for x in counts_line.split()]
+        if len(species) != len(counts):
+            raise ValueError("%s: %i species for %i counts" % (self.filename, len(species), len(counts)))
+        self.species, self.counts = species, counts
+        self.symbols = [s for s, n in zip(species, counts) for _ in range(n)]
+        self.n_atoms = sum(counts)
+        self._check_config(stream.readline())
+
+    def _check_config(self, line):
+        if not _is_config(line):
+            raise ValueError("%s: expected a Direct configuration line, got %r" % (self.filename, line))
+
+    def _truncated(self, k):
+        """Warn that frame k is incomplete (e.g. being written by a running simulation)"""
+        logger_setup(__name__).warning("%s: frame %i is truncated, stopping at the last complete frame",
+                                       self.filename, k)
+        return False
+
+    def _skip_header(self, title):
+        """Read the header repeated in variable-cell files: return the new cell, None if truncated"""
+        stream = self._stream
+        lines = [stream.readline() for _ in range(5)]
+        if not lines[-1].strip():
+            return None
+        cell = _parse_cell(lines[0], lines[1:4])
+        line = lines[4]
+        if not line.split()[0].isdigit(): # Species line
+            line = stream.readline()
+            if not line.strip():
+                return None
+        if [int(x) for x in line.split()] != self.counts:
+            raise ValueError("%s: composition changes along the trajectory" % self.filename)
+        line = stream.readline()
+        if not line.strip():
+            return None
+        self._check_config(line)
+        return cell
+
+    def _read_frame_head(self, cell, k):
+        """Read the lines before the coordinates: configuration line (fixed cell) or a new header
+        (variable cell), updating cell. Return False at the end of the file or if the header is truncated."""
+        line = self._stream.readline()
+        if not line.strip():
+            return False
+        if not line.endswith(b"\n"):
+            return self._truncated(k)
+        if _is_config(line):
+            if self.variable_cell is None:
+                self.variable_cell = False
+        else:
+            self.variable_cell = True
+            new_cell = self._skip_header(line)
+            if new_cell is None:
+                return self._truncated(k)
+            cell[:] = new_cell
+        return True
+
+    def _read_coords(self, frac, k, skip=False):
+        """Read the coordinate block in frac (unless skip).
+        Return False at the end of the file or if the block is truncated (last frame being written)."""
+        n_atoms = self.n_atoms
+        lines = [self._stream.readline() for _ in range(n_atoms)]
+        if not lines[-1]:
+            if lines[0]:
+                return self._truncated(k)
+            return False
+        if not lines[-1].endswith(b"\n"): # Last line possibly half written
+            return self._truncated(k)
+        if skip:
+            return True
+        fields = b" ".join(lines).split()
+        if len(fields) != 3*n_atoms: # Extra columns: keep the first three
+            fields = [x for l in lines for x in l.split()[:3]]
+        frac[:] = np.array(fields, dtype=float).reshape(n_atoms, 3)
+        return True
+
+    @profiled
+    def frames(self, start=None, stop=None, step=None, copy=False):
+        """Yield (frame index, cell, fractional positions) for frames start:stop:step (default all).
+
+        The cell and positions arrays are reused buffers, overwritten at each frame:
+        use copy=True to get new arrays (memory then grows if they are kept).
+        On uncompressed files a slice seeks straight to its frames through frame_index;
+        otherwise the frames before it are skipped without parsing, and negative indices are not allowed.
+        A truncated last frame (file still being written) ends the iteration with a warning."""
+        cell = self.cell.copy()
+        frac = np.empty((self.n_atoms, 3))
+
+        if (start, stop, step) != (None, None, None) and self._stream.seekable():
+            offsets = frame_index(self.filename, "xdatcar")
+            for k in _frame_range(len(offsets), start, stop, step):
+                self._stream.seek(offsets[k])
+                if not (self._read_frame_head(cell, k) and self._read_coords(frac, k)):
+                    return
+                yield (k, cell.copy(), frac.copy()) if copy else (k, cell, frac)
+            return
+
+        start, step = start or 0, step or 1
+        if start < 0 or (stop is not None and stop < 0) or step < 1:
+            raise ValueError("%s: negative start or stop need an uncompressed, indexed file" % self.filename)
+        k = 0
+        while stop is None or k < stop:
+            if k > 0 and not self._read_frame_head(cell, k):
+                return
+            take = k >= start and (k-start) % step == 0
+            if not self._read_coords(frac, k, skip=not take):
+                return
+            if take:
+                yield (k, cell.copy(), frac.copy()) if copy else (k, cell, frac)
+            k += 1
+
+    def to_atoms(self, cell, frac, atoms=None):
+        """ASE Atoms with given cell and fractional positions. If atoms is given, it is updated in place."""
+        if atoms is None:
+            from ase import Atoms
+            return Atoms(self.symbols, cell=cell, scaled_positions=frac, pbc=True)
+        atoms.set_cell(cell)
+        atoms.set_scaled_positions(frac)
+        return atoms
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_xdatcar(filename="XDATCAR", start=None, stop=None, step=None):
+    """Yield (frame index, ASE Atoms) of XDATCAR file, one frame at a time, for frames start:stop:step.
+
+    The same Atoms object is updated in place at each frame: copy it to keep it."""
+    with Xdatcar(filename) as xdat:
+        atoms = None
+        for k, cell, frac in xdat.frames(start, stop, step):
+            atoms = xdat.to_atoms(cell, frac, atoms)
+            yield k, atoms
+
+#-------------------------------------------------------------------------------
+# xyz
+#-------------------------------------------------------------------------------
+def iter_xyz(filename, start=None, stop=None, step=None):
+    """Yield (frame index, ASE Atoms) of uncompressed xyz file for frames start:stop:step, through frame_index"""
+    from ase.io.extxyz import read_xyz
+    offsets = frame_index(filename, "xyz")
+    with open(filename, 'rb') as in_file, \
+         mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        ends = np.append(offsets[1:], len(buf))
+        for k in _frame_range(len(offsets), start, stop, step):
+            frame = io.StringIO(buf[offsets[k]:ends[k]].decode())
+            yield k, next(read_xyz(frame, index=0))
+
+#-------------------------------------------------------------------------------
+# Bulk xyz writer
+#-------------------------------------------------------------------------------
+class XyzWriter:
+    """Formatter of plain xyz frames, compiled once for the atom symbols.
+
+    Lines are the same as ase.io.extxyz.write_xyz with a comment: "%-2s %16.8f %16.8f %16.8f".
+    The frame template has the symbols already in place, so that all the positions of a frame
+    are formatted by a single % operation."""
+
+    def __init__(self, symbols, fmt="%16.8f"):
+        self.symbols = list(symbols)
+        atom_fmt = " ".join([fmt]*3) + "\n"
+        self._frame_tmpl = "%i\n%%s\n" % len(self.symbols) + \
+                           "".join(("%-2s " % s).replace("%", "%%") + atom_fmt for s in self.symbols)
+
+    def format_frame(self, positions, comment=""):
+        """Text of a frame: Cartesian positions (atoms, 3) and comment line (trailing spaces stripped, as ASE)"""
+        comment = comment.rstrip()
+        if "\n" in comment:
+            raise ValueError("Comment line should not have line breaks")
+        return self._frame_tmpl % ((comment,) + tuple(np.asarray(positions).ravel().tolist()))
+
+    def format_block(self, positions, comments):
+        """Text of a block of frames: positions (frames, atoms, 3) and one comment per frame"""
+        return "".join(self.format_frame(p, c) for p, c in zip(positions, comments))
+
+_xyz_writers = {} # Formatters of the worker processes, by symbols and format
+
+def _format_xyz_block(args):
+    """Worker of write_xyz_frames: text of a block of frames"""
+    symbols, fmt, positions, comments = args
+    key = (tuple(symbols), fmt)
+    if key not in _xyz_writers:
+        _xyz_writers[key] = XyzWriter(symbols, fmt)
+    return _xyz_writers[key].format_block(positions, comments)
+
+@profiled
+def write_xyz_frames(stream, symbols, frames, n_proc=1, block=64, fmt="%16.8f"):
+    """Write the frames, iterable of (comment, Cartesian positions), on text stream in xyz format.
+
+    Frames are formatted in blocks of block frames. With n_proc > 1 the blocks are formatted by a pool
+    of processes and written in frame order; at most 2*n_proc blocks are in flight.
+    Return the number of frames written."""
+    import itertools
+    frames = iter(frames)
+
+    def blocks():
+        while True:
+            chunk = list(itertools.islice(frames, block))
+            if not chunk:
+                return
+            yield (symbols, fmt, np.array([p for _, p in chunk]), [c for c, _ in chunk])
+
+    n_frames = 0
+    if n_proc == 1:
+        writer = XyzWriter(symbols, fmt)
+        for _, _, positions, comments in blocks():
+            stream.write(writer.format_block(positions, comments))
+            n_frames += len(comments)
+        return n_frames
+
+    import collections
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=n_proc) as pool:
+        pending = collections.deque()
+        for task in blocks():
+            pending.append((pool.submit(_format_xyz_block, task), len(task[3])))
+            if len(pending) >= 2*n_proc:
+                future, n = pending.popleft()
+                stream.write(future.result())
+                n_frames += n
+        while pending:
+            future, n = pending.popleft()
+            stream.write(future.result())
+            n_frames += n
+    return n_frames
+
+#-------------------------------------------------------------------------------
+# Binary memory-mapped trajectories
+#-------------------------------------------------------------------------------
+# A trajectory is a directory with:
+# - header.json: format version, symbols, positions dtype, first cell, variable_cell flag;
+# - positions.bin: Cartesian positions, contiguous (frames, atoms, 3) block of float32 or float64;
+# - cells.bin: (frames, 3, 3) float64 cells (vectors as rows), only if the cell changes.
+# The number of frames follows from the file sizes: appending is writing at the end of the .bin files,
+# and a partially written frame is ignored by readers.
+_TRAJ_VERSION = 1
+_TRAJ_HEADER = "header.json"
+_TRAJ_POSITIONS = "positions.bin"
+_TRAJ_CELLS = "cells.bin"
+
+def _read_traj_header(dirname):
+    import json
+    with open(os.path.join(dirname, _TRAJ_HEADER), 'r') as header_file:
+        header = json.load(header_file)
+    if header.get("version") != _TRAJ_VERSION:
+        raise ValueError("%s: unsupported trajectory version %r" % (dirname, header.get("version")))
+    return header
+
+def _write_traj_header(dirname, header):
+    import json
+    path = os.path.join(dirname, _TRAJ_HEADER)
+    with open(path+".tmp", 'w') as header_file:
+        json.dump(header, header_file, indent=1)
+    os.replace(path+".tmp", path)
+
+class TrajWriter:
+    """Write frames to a binary memory-mapped trajectory directory (see MemmapTrajectory).
+
+    symbols: one chemical symbol per atom; dtype: float32 or float64 positions, default float32.
+    If append is True and dirname holds a trajectory, frames are added at its end: symbols must match,
+    dtype defaults to the one of the trajectory (and must match if given). Otherwise it is overwritten.
+    Cells are stored once, until a frame comes with a different one: then per frame.
+
+    Use as a context manager, or call close()."""
+
+    def __init__(self, dirname, symbols, dtype=None, append=False):
+        self.dirname = dirname
+        symbols = list(symbols)
+        pos_path = os.path.join(dirname, _TRAJ_POSITIONS)
+        if append and os.path.exists(os.path.join(dirname, _TRAJ_HEADER)):
+            self.header = _read_traj_header(dirname)
+            if dtype is None:
+                dtype = self.header["dtype"]
+            if self.header["symbols"] != symbols or self.header["dtype"] != np.dtype(dtype).name:
+                raise ValueError("%s: symbols or dtype differ from the trajectory to append to" % dirname)
+            # Drop a partially written frame, if any
+            self.n_frames = _traj_n_frames(dirname, self.header)
+            frame_bytes = len(symbols)*3*np.dtype(dtype).itemsize
+            os.truncate(pos_path, self.n_frames*frame_bytes)
+            if self.header["variable_cell"]:
+                os.truncate(os.path.join(dirname, _TRAJ_CELLS), self.n_frames*9*8)
+        else:
+            if dtype is None:
+                dtype = "float32"
+            os.makedirs(dirname, exist_ok=True)
+            for name in (_TRAJ_POSITIONS, _TRAJ_CELLS):
+                if os.path.exists(os.path.join(dirname, name)):
+                    os.remove(os.path.join(dirname, name))
+            self.header = {"version": _TRAJ_VERSION, "symbols": symbols, "dtype": np.dtype(dtype).name,
+                           "cell": None, "variable_cell": False}
+            self.n_frames = 0
+            open(pos_path, 'wb').close()
+            _write_traj_header(dirname, self.header)
+        self.dtype = np.dtype(self.header["dtype"])
+        self._pos_file = open(pos_path, 'ab')
+        self._cell_file = None
+        if self.header["variable_cell"]:
+            self._cell_file = open(os.path.join(dirname, _TRAJ_CELLS), 'ab')
+
+    def _set_variable_cell(self):
+        """Switch to per-frame cells: the previous frames get the constant cell"""
+        self._cell_file = open(os.path.join(self.dirname, _TRAJ_CELLS), 'wb')
+        np.tile(np.array(self.header["cell"], dtype=np.float64), (self.n_frames, 1, 1)).tofile(self._cell_file)
+        self.header["variable_cell"] = True
+        _write_traj_header(self.dirname, self.header)
+
+    def write(self, positions, cell):
+        """Append one frame: Cartesian positions (atoms, 3) and cell (vectors as rows)"""
+        positions = np.asarray(positions, dtype=self.dtype)
+        if positions.shape != (len(self.header["symbols"]), 3):
+            raise ValueError("Positions must have shape (%i, 3)" % len(self.header["symbols"]))
+        cell = np.asarray(cell, dtype=np.float64)
+        if self.header["cell"] is None:
+            self.header["cell"] = cell.tolist()
+            _write_traj_header(self.dirname, self.header)
+        elif not self.header["variable_cell"] and not np.array_equal(cell, self.header["cell"]):
+            self._set_variable_cell()
+        # Cell first: readers count frames on the positions
+        if self._cell_file is not None:
+            cell.tofile(self._cell_file)
+            self._cell_file.flush()
+        positions.tofile(self._pos_file)
+        self._pos_file.flush()
+        self.n_frames += 1
+
+    def close(self):
+        self._pos_file.close()
+        if self._cell_file is not None:
+            self._cell_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _traj_n_frames(dirname, header):
+    """Number of complete frames in trajectory directory"""
+    frame_bytes = len(header["symbols"])*3*np.dtype(header["dtype"]).itemsize
+    n_frames = os.path.getsize(os.path.join(dirname, _TRAJ_POSITIONS)) // frame_bytes
+    if header["variable_cell"]:
+        n_frames = min(n_frames, os.path.getsize(os.path.join(dirname, _TRAJ_CELLS)) // (9*8))
+    return n_frames
+
+class MemmapTrajectory:
+    """Binary trajectory directory opened as read-only memory maps.
+
+    Attributes: symbols, n_atoms, positions (frames, atoms, 3) and cells (frames, 3, 3, vectors as rows).
+    Slicing positions by frames or atom ranges gives views: nothing is read until used.
+    Call refresh() to see the frames appended after opening."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.refresh()
+
+    def refresh(self):
+        header = _read_traj_header(self.dirname)
+        self.symbols = header["symbols"]
+        self.n_atoms = len(self.symbols)
+        self.variable_cell = header["variable_cell"]
+        n_frames = _traj_n_frames(self.dirname, header)
+        if n_frames == 0:
+            self.positions = np.zeros((0, self.n_atoms, 3), dtype=header["dtype"])
+            self.cells = np.zeros((0, 3, 3))
+            return
+        self.positions = np.memmap(os.path.join(self.dirname, _TRAJ_POSITIONS), dtype=header["dtype"],
+                                   mode='r', shape=(n_frames, self.n_atoms, 3))
+        if self.variable_cell:
+            self.cells = np.memmap(os.path.join(self.dirname, _TRAJ_CELLS), dtype=np.float64,
+                                   mode='r', shape=(n_frames, 3, 3))
+        else:
+            self.cells = np.broadcast_to(np.array(header["cell"]), (n_frames, 3, 3))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def to_atoms(self, k):
+        """ASE Atoms of frame k"""
+        from ase import Atoms
+        return Atoms(self.symbols, positions=self.positions[k], cell=self.cells[k], pbc=True)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""Mean squared displacement (MSD) of MD trajectories, per species"""
+
+################################################################################
+# Preliminaries
+################################################################################
+import sys, os, argparse, logging, itertools
+import numpy as np
+from useful_functions import logger_setup, enable_profiling, profiled, open_stream
+from geometry import frac_part
+from traj_io import Xdatcar, MemmapTrajectory
+
+#-------------------------------------------------------------------------------
+# Unwrapping
+#-------------------------------------------------------------------------------
+def unwrap_frames(frames):
+    """Yield (frame index, unwrapped Cartesian positions) of frames, iterable of (frame index, cell, fractional positions).
+
+    Displacements between consecutive frames follow the minimum image (geometry.frac_part):
+    atoms must move less than half a cell between two consecutive frames of the trajectory, so frames
+    must not be subsampled before unwrapping (use subsample_frames after it).
+    Positions are relative to the first frame. The positions array is a reused buffer, overwritten at each frame."""
+    prev, disp = None, None
+    for k, cell, frac in frames:
+        if prev is None:
+            prev, disp = frac.copy(), np.zeros_like(frac)
+        else:
+            disp += np.dot(frac_part(frac-prev), cell)
+            prev[:] = frac
+        yield k, disp
+
+def subsample_frames(frames, step=None):
+    """Keep one every step of frames, iterable of (frame index, positions), e.g. from unwrap_frames"""
+    return itertools.islice(frames, 0, None, step)
+
+def memmap_frames(traj, start=None, stop=None, step=None):
+    """Yield (frame index, cell, fractional positions) of a MemmapTrajectory, as Xdatcar.frames"""
+    for k in range(len(traj))[slice(start, stop, step)]:
+        cell = np.asarray(traj.cells[k])
+        yield k, cell, np.dot(traj.positions[k], np.linalg.inv(cell))
+
+#-------------------------------------------------------------------------------
+# MSD
+#-------------------------------------------------------------------------------
+def msd_fft(x):
+    """Sums over the time origins of the squared displacements, for each lag and atom, in O(T log T).
+
+    x is the (T, N, 3) array of positions. Return a (T, N) array, with row m the sum of |x(t+m)-x(t)|^2
+    over the T-m origins t: S1(m) - 2*S2(m), with S2 the position autocorrelation computed by FFT."""
+    n_t = len(x)
+    sq = np.square(x).sum(axis=2)
+    cum = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(sq, axis=0)])
+    lags = np.arange(n_t)
+    s1 = cum[n_t-lags] + (cum[n_t]-cum[lags])
+    fx = np.fft.rfft(x, n=2*n_t, axis=0)
+    s2 = np.fft.irfft(np.square(np.abs(fx)), n=2*n_t, axis=0)[:n_t].sum(axis=2)
+    return s1 - 2*s2
+
+def species_groups(symbols):
+    """Dictionary species -> indices of its atoms, in order of appearance"""
+    symbols = np.asarray(symbols)
+    return {s: np.flatnonzero(symbols == s) for s in dict.fromkeys(symbols.tolist())}
+
+def msd_species_sums(x, groups, max_bytes=2**28):
+    """(T, species) sums of msd_fft over the atoms of each group. Atoms are processed in chunks,
+    so that the FFT buffers take about max_bytes."""
+    n_t = len(x)
+    chunk = max(1, max_bytes//(2*n_t*3*16))
+    res = np.zeros((n_t, len(groups)))
+    for j, idx in enumerate(groups.values()):
+        for i in range(0, len(idx), chunk):
+            res[:, j] += msd_fft(x[:, idx[i:i+chunk]]).sum(axis=1)
+    return res
+
+@profiled
+def msd(frames, n_atoms, groups, window=None, stride=None):
+    """Per-species MSD of frames, iterable of (frame index, unwrapped positions) as given by unwrap_frames.
+
+    Without window, all frames are kept in memory and all the lags are computed.
+    With window, frames are processed in windows of that many frames, starting every stride frames
+    (default window, i.e. no overlap): lags go up to window-1 and memory does not depend on the trajectory length.
+    Frames after the last full window are not used.
+    Return (lags, (lags, species) MSD array), averaged over the atoms of each species and the time origins."""
+    n_group = np.array([len(idx) for idx in groups.values()])
+    if window is None:
+        x = np.array([r.copy() for _, r in frames])
+        if len(x) == 0:
+            return np.arange(0), np.zeros((0, len(groups)))
+        counts = np.arange(len(x), 0, -1)
+        res = msd_species_sums(x, groups)/np.outer(counts, n_group)
+        return np.arange(len(x)), np.maximum(res, 0) # Round-off at small lags
+
+    stride = window if stride is None else stride
+    if not 0 < stride <= window:
+        raise ValueError("Stride must be in (0, window]")
+    buf = np.empty((window, n_atoms, 3))
+    sums, counts = np.zeros((window, len(groups))), np.zeros(window)
+    n_buf, n_win = 0, 0
+    for _, r in frames:
+        buf[n_buf] = r
+        n_buf += 1
+        if n_buf == window:
+            sums += msd_species_sums(buf, groups)
+            counts += np.arange(window, 0, -1)
+            n_win += 1
+            # Keep the overlap with the next window
+            buf[:window-stride] = buf[stride:]
+            n_buf = window-stride
+    if n_win == 0 and n_buf > 0: # Shorter than a window: use what there is
+        sums[:n_buf] += msd_species_sums(buf[:n_buf], groups)
+        counts[:n_buf] += np.arange(n_buf, 0, -1)
+    lags = np.flatnonzero(counts)
+    return lags, np.maximum(sums[lags]/np.outer(counts[lags], n_group), 0) # Round-off at small lags
+
+################################################################################
+# Command line
+################################################################################
+def traj_msd(argv):
+    """Mean squared displacement of each species along an MD trajectory.
+
+    Input is an XDATCAR (possibly compressed) or a binary trajectory directory written by xdat_to_xyz.py --traj.
+    Positions are unwrapped frame by frame with the minimum image convention, through all the frames
+    from start to stop even with --step, then the MSD is computed with FFTs in O(T log T).
+    With --window, the trajectory is streamed in windows of frames instead of loaded.
+
+    Output is a column file: lag time (fs if --dt is given, else frames) and the MSD of each species (A^2)."""
+
+    #-------------------------------------------------------------------------------
+    # Argument parser
+    #-------------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(description=traj_msd.__doc__)
+    # Positional arguments
+    parser.add_argument('filename',
+                        default='XDATCAR',
+                        type=str, nargs='?',
+                        help='XDATCAR or binary trajectory directory. If not given XDATCAR is used;')
+    # Optional args
+    parser.add_argument('-o', '--output',
+                        dest='output', default=None,
+                        help='output file, compressed if ending in .gz, .bz2 or .xz (default stdout);')
+    parser.add_argument('--dt',
+                        dest='dt', type=float, default=None,
+                        help='timestep in femptosecond;')
+    parser.add_argument('--start',
+                        dest='start', type=int, default=None,
+                        help='first frame (default 0);')
+    parser.add_argument('--stop',
+                        dest='stop', type=int, default=None,
+                        help='frame to stop at, excluded (default last);')
+    parser.add_argument('--step',
+                        dest='step', type=int, default=None,
+                        help='take one frame every step, after unwrapping all of them (default 1);')
+    parser.add_argument('-w', '--window',
+                        dest='window', type=int, default=None,
+                        help='streaming mode: frames per window, i.e. max lag+1 (default all frames in memory);')
+    parser.add_argument('--stride',
+                        dest='stride', type=int, default=None,
+                        help='frames between the starts of two windows (default window);')
+    parser.add_argument('--debug',
+                        action='store_true', dest='debug',
+                        help='show debug informations.')
+
+    #-------------------------------------------------------------------------------
+    # Initialize and check variables
+    #-------------------------------------------------------------------------------
+    args = parser.parse_args(argv)
+
+    # Set up logger and debug options
+    c_log = logger_setup(__name__)
+    c_log.setLevel(logging.INFO)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
+    c_log.debug(args)
+
+    t_unit = "fs"
+    if args.dt is None:
+        args.dt = 1
+        t_unit = "frames"
+    frame_dt = args.dt*(args.step or 1)
+
+    #-------------------------------------------------------------------------------
+    # Unwrap and compute
+    #-------------------------------------------------------------------------------
+    if os.path.isdir(args.filename):
+        traj = MemmapTrajectory(args.filename)
+        symbols = traj.symbols
+        frames = subsample_frames(unwrap_frames(memmap_frames(traj, args.start, args.stop)), args.step)
+        lags, res = msd(frames, len(symbols), species_groups(symbols),
+                        window=args.window, stride=args.stride)
+    else:
+        with Xdatcar(args.filename) as xdat:
+            symbols = xdat.symbols
+            frames = subsample_frames(unwrap_frames(xdat.frames(args.start, args.stop)), args.step)
+            lags, res = msd(frames, len(symbols), species_groups(symbols),
+                            window=args.window, stride=args.stride)
+    c_log.debug("%i lags", len(lags))
+
+    #-------------------------------------------------------------------------------
+    # Write columns
+    #-------------------------------------------------------------------------------
+    species = list(species_groups(symbols))
+    header = "time(%s) " % t_unit + " ".join("msd_%s(A^2)" % s for s in species)
+    with open_stream(args.output, 'w') as out_stream:
+        np.savetxt(out_stream, np.column_stack([lags*frame_dt, res]), fmt="%.8g", header=header)
+    return 0
+
+################################################################################
+# MAIN
+################################################################################
+if __name__ == "__main__":
+    # Restore default SIGPIPE handler, as in xdat_to_xyz.py
+    import signal
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    exit(traj_msd(sys.argv[1:]))
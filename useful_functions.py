@@ -5,7 +5,7 @@
 
 A collection of often-used functions:
  - code shortcuts;
- - smart file readers;
+ - smart file readers, transparent to compression;
  - string formatter;
  - container manipulators;
 
@@ -15,8 +15,19 @@ Created:    Silva 29-01-2018
 Last edit:  Silva 03-11-2019
 """
 
-import collections
+import collections.abc
+import contextlib
+import functools
 import logging
+import importlib
+import inspect
+import io
+import os
+import queue
+import sys
+import threading
+import time
+import types
 
 #------------------------------------------------------------------------------#
 # Bash-like script setup shortcuts
@@ -33,6 +44,165 @@ def logger_setup(module_name):
     # Logging level is defined by calling module via root logger
     return c_log
 
+#------------------------------------------------------------------------------#
+# Profiling: call counters and accumulated time
+#------------------------------------------------------------------------------#
+# Functions decorated with @profiled and blocks in "with timer(name)" are timed only if profiling is on.
+# Turn it on with the environment variable UTIL_PROFILE (any non-empty value) or enable_profiling(),
+# e.g. when scripts get --debug. At exit the stats are logged; if UTIL_PROFILE_JSON is set, they are
+# also dumped as json in that file. When off, a decorated function costs one extra call.
+_prof = {"on": False, "report": False}
+_prof_stats = {} # name --> [calls, total time]
+
+def _prof_add(name, dt):
+    stat = _prof_stats.get(name)
+    if stat is None:
+        _prof_stats[name] = [1, dt]
+    else:
+        stat[0] += 1
+        stat[1] += dt
+
+def profile_stats():
+    """Return the profiling stats as dict name --> {"calls", "total", "mean"} (times in s)"""
+    return {name: {"calls": n, "total": t, "mean": t/n} for name, (n, t) in _prof_stats.items()}
+
+def profile_report(json_file=None):
+    """Log the profiling stats, sorted by total time, and optionally dump them to json_file"""
+    c_log = logger_setup(__name__)
+    c_log.setLevel(logging.INFO)
+    stats = profile_stats()
+    for name, st in sorted(stats.items(), key=lambda x: -x[1]["total"]):
+        c_log.info("%-45s %8i calls %12.6f s %12.3e s/call", name, st["calls"], st["total"], st["mean"])
+    if json_file:
+        import json
+        with open(json_file, 'w') as out_file:
+            json.dump(stats, out_file, indent=1)
+
+def enable_profiling(on=True):
+    """Switch profiling on (or off). The report is printed at exit."""
+    _prof["on"] = on
+    if on and not _prof["report"]:
+        import atexit
+        atexit.register(lambda: profile_report(os.environ.get("UTIL_PROFILE_JSON")))
+        _prof["report"] = True
+
+def _profiled_gen(name, gen):
+    """Time the work done inside a generator, not the one of its consumer"""
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(gen)
+        except StopIteration:
+            _prof_add(name, time.perf_counter()-t0)
+            return
+        _prof_add(name, time.perf_counter()-t0)
+        yield item
+
+def profiled(func):
+    """Decorator: count calls and accumulate the time of func when profiling is on.
+
+    For generator functions, the time spent producing each item is accumulated (one call per item)."""
+    name = "%s.%s" % (func.__module__, func.__qualname__)
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            if not _prof["on"]:
+                return func(*args, **kwargs)
+            return _profiled_gen(name, func(*args, **kwargs))
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _prof["on"]:
+            return func(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _prof_add(name, time.perf_counter()-t0)
+    return wrapper
+
+@contextlib.contextmanager
+def timer(name):
+    """Context manager: count and accumulate the time of the block under given name, when profiling is on"""
+    if not _prof["on"]:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _prof_add(name, time.perf_counter()-t0)
+
+if os.environ.get("UTIL_PROFILE"):
+    enable_profiling()
+
+#------------------------------------------------------------------------------#
+# Lazy imports
+#------------------------------------------------------------------------------#
+# Set UTIL_IMPORT_TIME to any non-empty value to log the time spent in each lazy import.
+# For the eager imports of a script, use python -X importtime script.py
+_import_times = []
+
+def _import_report():
+    """Log the summary of the lazy imports (registered at exit if UTIL_IMPORT_TIME is set)"""
+    c_log = logger_setup(__name__)
+    c_log.setLevel(logging.INFO)
+    for name, dt in sorted(_import_times, key=lambda x: -x[1]):
+        c_log.info("%-30s %10.2f ms", name, 1e3*dt)
+    c_log.info("%-30s %10.2f ms", "lazy imports total", 1e3*sum(dt for _, dt in _import_times))
+
+if os.environ.get("UTIL_IMPORT_TIME"):
+    import atexit
+    atexit.register(_import_report)
+
+class LazyModule(types.ModuleType):
+    """Placeholder of a module, actually imported at the first attribute access.
+
+    Submodules not imported by the package are imported on access too, e.g. lazy_import("ase").io"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        mod = self.__dict__['_lazy_module']
+        if mod is None:
+            t0 = time.perf_counter()
+            mod = importlib.import_module(self.__name__)
+            _import_times.append((self.__name__, time.perf_counter()-t0))
+            self.__dict__['_lazy_module'] = mod
+        return mod
+
+    def __getattr__(self, attr):
+        mod = self._load()
+        try:
+            val = getattr(mod, attr)
+        except AttributeError:
+            try:
+                val = importlib.import_module(self.__name__+"."+attr)
+            except ImportError:
+                raise AttributeError("module '%s' has no attribute '%s'" % (self.__name__, attr))
+        # Store it: next accesses do not pass through here
+        self.__dict__[attr] = val
+        return val
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__['_lazy_module'] else "not loaded"
+        return "<lazy module '%s' (%s)>" % (self.__name__, state)
+
+def lazy_import(name):
+    """Return module name, deferring the actual import until first use.
+
+    Use it at the top of scripts for heavy packages (ase, matplotlib, pymatgen, ...),
+    so that --help or paths not needing them start fast."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
 #------------------------------------------------------------------------------#
 # Shortcut
 #------------------------------------------------------------------------------#
@@ -46,11 +216,215 @@ def lmap(func, listarg):
     """Map given function to given list and return a list instead of iterator"""
     return list(map(func, listarg))
 
+#------------------------------------------------------------------------------#
+# Compressed streams
+#------------------------------------------------------------------------------#
+# gzip, bz2 and xz files are recognised by their first bytes, not by the name.
+# Reading: decompression runs in a background thread (zlib, bz2 and lzma release the GIL),
+# feeding a bounded queue of chunks, so parsing overlaps with it.
+# Writing: compression is given explicitly or guessed from the extension.
+_COMPRESSION_MAGIC = ((b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "xz"))
+_COMPRESSION_EXT = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".lzma": "xz"}
+COMPRESSIONS = ("gzip", "bz2", "xz")
+
+def _compression_module(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression %r, use one of %s" % (compression, COMPRESSIONS))
+    return importlib.import_module({"gzip": "gzip", "bz2": "bz2", "xz": "lzma"}[compression])
+
+def detect_compression(head):
+    """Compression ("gzip", "bz2", "xz") of data beginning with bytes head, None if not compressed"""
+    for magic, compression in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+def file_compression(filename):
+    """Compression of given file, from its first bytes. None if not compressed."""
+    with open(filename, 'rb') as in_file:
+        return detect_compression(in_file.read(6))
+
+def strip_compression_ext(filename):
+    """Filename without the compression extension (.gz, .bz2, .xz, .lzma), if any"""
+    root, ext = os.path.splitext(filename)
+    return root if ext.lower() in _COMPRESSION_EXT else filename
+
+class _PrefixedReader(io.RawIOBase):
+    """Raw binary stream giving first the bytes prefix, then the content of stream (not closed with it)"""
+
+    def __init__(self, prefix, stream):
+        self._prefix, self._stream = memoryview(prefix), stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        return self._stream.readinto(b)
+
+class _ThreadedReader(io.RawIOBase):
+    """Raw binary stream reading stream in a background thread, in chunks of chunk_size bytes.
+
+    At most max_chunks chunks are queued ahead of the consumer. Errors of the reader thread are
+    raised by the consumer. stream is closed with it."""
+
+    def __init__(self, stream, chunk_size=2**20, max_chunks=8):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(max_chunks)
+        self._stop = threading.Event()
+        self._chunk, self._pos, self._eof = b"", 0, False
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self):
+        try:
+            while True:
+                chunk = self._stream.read(self._chunk_size)
+                if not self._put(chunk) or not chunk:
+                    return
+        except BaseException as err:
+            self._put(err)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk, self._pos = memoryview(item), 0
+        n = min(len(b), len(self._chunk)-self._pos)
+        b[:n] = self._chunk[self._pos:self._pos+n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            # Free a slot in case the thread is waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._thread.join(0.01)
+            self._stream.close()
+        super().close()
+
+def _open_read(filename, threaded):
+    """Binary stream with the decompressed content of filename (None or - for stdin)"""
+    if filename in (None, "-"):
+        stdin = sys.stdin.buffer
+        head = stdin.read(6)
+        compression = detect_compression(head)
+        stream = io.BufferedReader(_PrefixedReader(head, stdin))
+        if compression is None:
+            return stream
+        stream = _compression_module(compression).open(stream, 'rb')
+    else:
+        compression = file_compression(filename)
+        if compression is None:
+            return open(filename, 'rb')
+        stream = _compression_module(compression).open(filename, 'rb')
+    if threaded:
+        stream = io.BufferedReader(_ThreadedReader(stream))
+    return stream
+
+def _open_write(filename, mode, compression, level):
+    """Binary stream compressing into filename (None or - for stdout)"""
+    if filename in (None, "-"):
+        sys.stdout.flush()
+        target = sys.stdout.buffer
+        if compression is None:
+            return target
+    else:
+        if compression is None:
+            compression = _COMPRESSION_EXT.get(os.path.splitext(filename)[1].lower())
+        if compression is None:
+            return open(filename, mode)
+        target = filename
+    module = _compression_module(compression)
+    if compression == "xz":
+        return module.open(target, mode, preset=level)
+    return module.open(target, mode, compresslevel=9 if level is None else level)
+
+def open_stream(filename=None, mode='r', compression=None, level=None, threaded=True, encoding=None):
+    """Open filename (None or - for stdin/stdout) decompressing or compressing it transparently.
+
+    mode is 'r', 'w' or 'a', with 'b' for binary and 't' (default) for text streams.
+    Reading: gzip, bz2 and xz compression is detected from the first bytes, whatever the name.
+             If threaded, decompression runs in a background thread.
+    Writing: compression ("gzip", "bz2", "xz") is taken from the extension if not given.
+             level is the compression level (1-9, 0-9 for xz), default of the module if None.
+    Standard streams are not closed with the returned stream, except uncompressed stdout."""
+    binary = 'b' in mode
+    raw_mode = mode.replace('t', '').replace('b', '') + 'b'
+    if raw_mode == 'rb':
+        stream = _open_read(filename, threaded)
+    elif raw_mode in ('wb', 'ab'):
+        stream = _open_write(filename, raw_mode, compression, level)
+    else:
+        raise ValueError("Invalid mode %r" % (mode,))
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding)
+
 #------------------------------------------------------------------------------#
 # Read files smartly
 #------------------------------------------------------------------------------#
+# Kind of the records yielded by iter_stream
+COMMENT = "comment"
+DATA = "data"
+
+def iter_stream(stream, comment_char="#", f=lambda x: x):
+    """Lazily read given stream object, line by line.
+
+    Yield a record (line number, kind, fields) per line:
+    - comment lines (starting with comment_char, default #): kind is COMMENT, fields is the stripped line;
+    - data lines: kind is DATA, fields is the list of fields with function f applied to each one.
+    Blank lines are skipped, line numbers still count them.
+    If comment_char is None, all lines are data.
+
+    Only one line at a time is in memory: suitable for big files and pipes."""
+
+    for i, l in enumerate(stream):
+        l = l.strip()
+        if not l:
+            continue
+        if comment_char is not None and l[0] == comment_char:
+            yield i, COMMENT, l
+        else:
+            yield i, DATA, [f(x) for x in l.split()]
+
+def iter_file(filename, comment_char="#", f=lambda x: x):
+    """Lazily read given filename (- or None for stdin), possibly compressed. Yield the records of iter_stream."""
+    with open_stream(filename) as in_file:
+        yield from iter_stream(in_file, comment_char=comment_char, f=f)
+
 # Load data (comments+data)
 # Should rename to split_stream
+@profiled
 def load_stream(stream, comment_char="#", f=lambda x: x, split=True):
     """Load given stream object.
 
@@ -62,55 +436,271 @@ def load_stream(stream, comment_char="#", f=lambda x: x, split=True):
     - True (default): return tuple (comments, data)
                       Comment lines l are return as "<comment_char><line number>:l".
     - False: return tuple (coment indices, ordered field-split data and comment)
+             Comment indices are positions in the returned list.
 
-    Not suitable for big files: all content loaded."""
-
-    stream_lines = stream.readlines()
+    Blank lines are skipped.
+    All content loaded: for big files iterate over iter_stream instead."""
 
     # Read the input file and filter the bash-like comments
     # Split comments and data in sparate objects
     if split:
-        comments = [(comment_char+"%i:"%i) + l[1:].strip()
-                    for i, l in enumerate(stream_lines)
-                    if l.strip()[0] == comment_char]
-        data = [[f(x) for x in l.strip().split()]
-                for l in stream_lines
-                if l.strip()[0] != comment_char]
+        comments, data = [], []
+        for i, kind, fields in iter_stream(stream, comment_char=comment_char, f=f):
+            if kind == COMMENT:
+                comments.append((comment_char+"%i:"%i) + fields[1:].strip())
+            else:
+                data.append(fields)
         return comments, data
 
     # Return comment lines number and ordered list of comments and data lines
     comment_lnum = []
     data = []
-    for i, l in enumerate(stream_lines):
-        l = l.strip()
-        if l[0] == comment_char:
-            comment_lnum.append(i)
-            data.append(l)
-        else:
-            data.append([f(x) for x in l.split()])
+    for i, kind, fields in iter_stream(stream, comment_char=comment_char, f=f):
+        if kind == COMMENT:
+            comment_lnum.append(len(data))
+        data.append(fields)
 
     return comment_lnum, data
 
+@profiled
 def load_file(filename, comment_char="#"):
     """Load given filename.
 
     Divide lines between comments and data.
-    Comment char can be given as input."""
-    with open(filename, 'r') as in_file:
+    Comment char can be given as input. Compressed files are read transparently."""
+    with open_stream(filename) as in_file:
         return load_stream(in_file, comment_char)
 
-def load_float_file(filename, comment_char="#"):
+def _ragged_row(rows, n_col):
+    """Index of the first row (list of fields) without n_col fields, None if all have them"""
+    for i, r in enumerate(rows):
+        if len(r) != n_col:
+            return i
+    return None
+
+def _parse_float_block(lines, n_col=None, line_nums=None):
+    """Parse a list of data lines in a (n_lines, n_col) float array with the C parser of np.loadtxt.
+
+    Each line must have n_col fields (default: as many as the first line), else ValueError is raised
+    with the number of the offending line: line_nums[i] if given, else its position in lines.
+    Lines are split in Python only to find the error when the fast parse fails."""
+    import numpy as np
+    import itertools
+    if n_col is None:
+        n_col = len(lines[0].split())
+    try:
+        data = np.loadtxt(lines, dtype=float, comments=None, ndmin=2)
+        if data.shape[1] == n_col:
+            return data
+    except ValueError:
+        pass
+    # Error path: ragged line, or field that only float() parses
+    rows = [l.split() for l in lines]
+    bad = _ragged_row(rows, n_col)
+    if bad is not None:
+        num = bad if line_nums is None else line_nums[bad]
+        raise ValueError("Line %i has %i columns, expected %i" % (num, len(rows[bad]), n_col))
+    return np.array(list(itertools.chain.from_iterable(rows)), dtype=float).reshape(len(rows), n_col)
+
+@profiled
+def parse_float_stream(stream, comment_char="#", chunk_lines=2**16):
+    """Parse numeric stream in chunks of lines, straight into a growing NumPy buffer.
+
+    Return (comments, data) as load_float_file: comments are "<comment_char><line number>:l",
+    data is a (n_lines, n_col) float array. All data lines must have the same number of columns:
+    ValueError gives the (0-based) number of the first line that does not."""
+    import numpy as np
+    import itertools
+    comments = []
+    buf, n_rows, n_col = None, 0, None
+    line_no = 0
+    while True:
+        lines = list(itertools.islice(stream, chunk_lines))
+        if not lines:
+            break
+        data_lines, data_nums = [], []
+        for i, l in enumerate(lines, start=line_no):
+            l = l.strip()
+            if not l:
+                continue
+            if comment_char is not None and l[0] == comment_char:
+                comments.append((comment_char+"%i:"%i) + l[1:].strip())
+            else:
+                data_lines.append(l)
+                data_nums.append(i)
+        line_no += len(lines)
+        if not data_lines:
+            continue
+        block = _parse_float_block(data_lines, n_col, data_nums)
+        if buf is None:
+            n_col = block.shape[1]
+            buf = np.empty((2*len(block), n_col))
+        # Grow in place (amortized doubling)
+        if n_rows+len(block) > buf.shape[0]:
+            buf.resize((max(2*buf.shape[0], n_rows+len(block)), n_col), refcheck=False)
+        buf[n_rows:n_rows+len(block)] = block
+        n_rows += len(block)
+    if buf is None:
+        return comments, np.array([])
+    buf.resize((n_rows, n_col), refcheck=False) # Trim unused capacity
+    return comments, buf
+
+def _float_cache_paths(filename, cache_dir=None):
+    """Return the path of the sidecar cache files (meta json, data npy) of filename"""
+    if cache_dir is None:
+        base = filename + ".cache"
+    else:
+        import hashlib
+        key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        base = os.path.join(cache_dir, os.path.basename(filename)+"."+key)
+    return base+".json", base+".npy"
+
+@profiled
+def load_float_file(filename, comment_char="#", cache=False, cache_dir=None):
     """Load given numeric filename.
 
     Each non-comment field will be cast to float and the whole stream in NumPy array.
-    Divide lines between comments and data.
-    Not suitable for big files."""
+    Divide lines between comments and data. The parsing is done in chunks, see parse_float_stream.
+
+    If cache is True, the data are saved in a .npy sidecar file (next to the file, or in cache_dir),
+    valid as long as file path, size and modification time do not change.
+    Following loads open it as a read-only memory map instead of parsing the text again:
+    data is then a read-only np.memmap, while a parse (no cache, or cache miss) gives a writable array.
+    If the sidecar cannot be written (e.g. read-only directory), the parsed data are returned anyway."""
     import numpy as np
+    import json
+
+    if cache:
+        meta_path, npy_path = _float_cache_paths(filename, cache_dir)
+        st = os.stat(filename)
+        key = {"path": os.path.abspath(filename), "size": st.st_size,
+               "mtime_ns": st.st_mtime_ns, "comment_char": comment_char}
+        try:
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+            if meta["key"] == key:
+                return meta["comments"], np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            pass # Missing or broken cache: parse again
+
+    with open(filename, 'r') as in_file:
+        c, d = parse_float_stream(in_file, comment_char=comment_char)
+
+    if cache:
+        # Write to temporary files and move, so a reader never sees half a cache
+        try:
+            np.save(npy_path+".tmp.npy", d)
+            os.replace(npy_path+".tmp.npy", npy_path)
+            with open(meta_path+".tmp", 'w') as meta_file:
+                json.dump({"key": key, "comments": c}, meta_file)
+            os.replace(meta_path+".tmp", meta_path)
+        except OSError as err:
+            logger_setup(__name__).debug("Cache not saved: %s", err)
+    return c, d
+
+def _line_ranges(filename, n_ranges):
+    """Split filename in about n_ranges byte ranges (start, end), each one ending on a newline"""
+    import mmap
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    with open(filename, 'rb') as in_file, \
+         mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        bounds = [0]
+        for k in range(1, n_ranges):
+            b = mm.find(b"\n", max(bounds[-1], k*size//n_ranges))
+            if b < 0:
+                break
+            if b+1 > bounds[-1] and b+1 < size:
+                bounds.append(b+1)
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _parse_float_range(args):
+    """Worker of load_float_file_parallel: parse the lines in a byte range of a memory mapped file.
+
+    Return (number of lines, comment local line numbers, comment lines, data array, bad line):
+    bad line is None, or (local line number, number of fields) of the first data line without n_col fields."""
+    import mmap
+    import numpy as np
+    filename, start, end, comment_char, n_col = args
+    with open(filename, 'rb') as in_file, \
+         mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lines = mm[start:end].decode().splitlines()
+    c_num, comments, data_lines, data_nums = [], [], [], []
+    for i, l in enumerate(lines):
+        l = l.strip()
+        if not l:
+            continue
+        if comment_char is not None and l[0] == comment_char:
+            c_num.append(i)
+            comments.append(l)
+        else:
+            data_lines.append(l)
+            data_nums.append(i)
+    if not data_lines:
+        return len(lines), c_num, comments, np.empty((0, n_col or 0)), None
+    try:
+        data = _parse_float_block(data_lines, n_col)
+    except ValueError:
+        bad = _ragged_row([l.split() for l in data_lines], n_col)
+        if bad is None: # Not a column count problem
+            raise
+        return len(lines), c_num, comments, None, (data_nums[bad], len(data_lines[bad].split()))
+    return len(lines), c_num, comments, data, None
+
+def _first_n_col(filename, comment_char):
+    """Number of fields of the first data line of filename, None if there is none"""
     with open(filename, 'r') as in_file:
-        # Appreciate the power of **kwarg expansion!
-        c, d = load_stream(in_file, **{"comment_char" : comment_char, "f": float})
-        d = np.array(d)
-        return c, d
+        for l in in_file:
+            l = l.strip()
+            if l and not (comment_char is not None and l[0] == comment_char):
+                return len(l.split())
+    return None
+
+@profiled
+def load_float_file_parallel(filename, comment_char="#", n_proc=None, min_range=2**20):
+    """Load given numeric filename with a pool of processes.
+
+    The file is memory mapped and split in newline-aligned byte ranges (at least min_range bytes each),
+    parsed in parallel and concatenated in order. All data lines must have as many columns as the first one:
+    ValueError gives the (0-based) number of the first line that does not.
+
+    Return (comment line numbers, comment lines, data array). Unlike load_stream(split=False), which
+    returns comment positions in its interleaved list of comments and data, the comment numbers here are
+    the 0-based line numbers in the file, blank lines included; comments are the stripped lines."""
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    if n_proc is None:
+        n_proc = os.cpu_count() or 1
+    size = os.path.getsize(filename)
+    # Same number of columns for all ranges: the one of the first data line
+    n_col = _first_n_col(filename, comment_char)
+    # A few ranges per process to balance the load
+    n_ranges = max(1, min(4*n_proc, size//min_range))
+    tasks = [(filename, start, end, comment_char, n_col) for start, end in _line_ranges(filename, n_ranges)]
+
+    if n_proc == 1 or len(tasks) <= 1:
+        results = list(map(_parse_float_range, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_proc) as pool:
+            results = list(pool.map(_parse_float_range, tasks))
+
+    # Shift local line numbers by the lines of the previous ranges
+    c_lnum, comments, blocks = [], [], []
+    line_no = 0
+    for n_lines, c_num, c_lines, data, bad in results:
+        if bad is not None:
+            raise ValueError("Line %i has %i columns, expected %i" % (line_no+bad[0], bad[1], n_col))
+        c_lnum.extend(line_no+i for i in c_num)
+        comments.extend(c_lines)
+        if data.size:
+            blocks.append(data)
+        line_no += n_lines
+    if not blocks:
+        return c_lnum, comments, np.array([])
+    return c_lnum, comments, np.concatenate(blocks)
 
 #------------------------------------------------------------------------------#
 # String formatting
@@ -160,6 +750,7 @@ def set_width(args, w=None, align_char="<", offset=2):
                     for s, w in zip(args, w_args)]
                   )
 
+@profiled
 def adjust_col_width(rows, align_char="<", offset=5):
     """Set width of a n-list of m-list to (max + offset) of each column
 
@@ -183,9 +774,10 @@ def adjust_col_width(rows, align_char="<", offset=5):
             if w_f > cols_w[j]:
                 cols_w[j] = w_f
 
-    # Apply width offset to computed width and set width of each row
-    return [set_width(r, [w+offset for w in cols_w], align_char=align_char)
-            for r in rows]
+    # Apply width offset to computed width and set width of each row.
+    # Same result of set_width, with the format compiled once for all rows.
+    fmt = ColumnFormatter([w+offset for w in cols_w], align_char=align_char)
+    return [fmt.format_row(r) for r in rows]
 
 def set_float_width(args, w=None, align_char="<", offset=2, prec=15):
     """Set convert list of float to string and set width
@@ -199,15 +791,103 @@ def set_float_width(args, w=None, align_char="<", offset=2, prec=15):
     args = [conv_tmpl % n for n in args ]
     return set_width(args, w=w, align_char=align_char, offset=offset)
 
+class ColumnFormatter:
+    """Row formatter for tables, compiled once from the column widths.
+
+    Each field is converted to string (or to float with prec digits, as set_float_width) and
+    aligned as in set_width: "<" left (default), "^" centred, ">" right.
+    Use format_row for a single row, write to render a whole table (NumPy array or iterable of rows)
+    on a writable stream in batches of rows."""
+
+    def __init__(self, widths, align_char="<", prec=None):
+        # Validate once for the whole table
+        if align_char not in ["<", "^", ">"]:
+            raise ValueError("Alignment char must be left (<), center (^) or right (>), not",
+                             align_char)
+        if False in [isinstance(wi, int) for wi in widths]:
+            raise ValueError("Width of each char must be int")
+        self.widths = list(widths)
+        self.align_char = align_char
+        self.prec = prec
+        # Template of the whole row
+        if prec is None:
+            self._row_tmpl = "".join("{!s:%s%i}" % (align_char, w) for w in self.widths)
+            self._conv_tmpl = None
+        else:
+            self._row_tmpl = "".join("{:%s%i}" % (align_char, w) for w in self.widths)
+            # Float conversion of the whole row at once, fields separated by a null char
+            self._conv_tmpl = "\0".join(["%"+"%i.%i" % (prec+5, prec)+"f"]*len(self.widths))
+
+    @classmethod
+    def from_rows(cls, rows, align_char="<", offset=5, prec=None):
+        """Formatter with width of each column set to (max + offset) of the given rows, as adjust_col_width"""
+        fmt = cls([0]*len(rows[0]), prec=prec)
+        cols_w = [0]*len(rows[0])
+        for r in rows:
+            if len(r) != len(cols_w):
+                raise ValueError("All lines must have same length")
+            fields = fmt._convert(r)
+            cols_w = list(map(max, cols_w, map(len, fields)))
+        return cls([w+offset for w in cols_w], align_char=align_char, prec=prec)
+
+    def _convert(self, row):
+        if self._conv_tmpl is None:
+            return [str(x) for x in row]
+        return (self._conv_tmpl % tuple(row)).split("\0")
+
+    def format_row(self, row):
+        """Return the formatted string of a row, without newline"""
+        if len(row) != len(self.widths):
+            raise ValueError("Width and args must have same length")
+        if self._conv_tmpl is None:
+            return self._row_tmpl.format(*row)
+        return self._row_tmpl.format(*(self._conv_tmpl % tuple(row)).split("\0"))
+
+    @profiled
+    def write(self, rows, stream, batch_size=4096):
+        """Write all rows on stream, one line each. rows can be a 2D NumPy array or any iterable of rows.
+
+        Lines are joined and written in batches of batch_size rows."""
+        import itertools
+        if hasattr(rows, "tolist"):
+            rows = rows.tolist() # Python scalars: much faster to format than NumPy ones
+        rows = iter(rows)
+        tmpl, conv = self._row_tmpl, self._conv_tmpl
+        n_col = len(self.widths)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            if any(len(r) != n_col for r in batch):
+                raise ValueError("Width and args must have same length")
+            if conv is None:
+                lines = [tmpl.format(*r) for r in batch]
+            else:
+                lines = [tmpl.format(*(conv % tuple(r)).split("\0")) for r in batch]
+            lines.append("")
+            stream.write("\n".join(lines))
+
 #------------------------------------------------------------------------------#
 # Lists manipulators
 #------------------------------------------------------------------------------#
 
+def _is_ndarray(x):
+    """True if x is a NumPy array. If NumPy was never imported, x cannot be one."""
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(x, np.ndarray)
+
 # Nice recursive, yield-wise flatten function
 def flatten(l):
-    """Flat list generator from nested lists"""
+    """Flat list generator from nested lists.
+
+    NumPy arrays (at any level) are flattened with ravel, without copy nor recursion."""
+    if _is_ndarray(l):
+        yield from l.ravel()
+        return
     for el in l:
-        if isinstance(el, collections.Iterable) and not isinstance(el, (str, bytes)):
+        if _is_ndarray(el):
+            yield from el.ravel()
+        elif isinstance(el, collections.abc.Iterable) and not isinstance(el, (str, bytes)):
             yield from flatten(el)
         else:
             yield el
@@ -215,11 +895,41 @@ def flatten(l):
 # Lazy way of do it...
 def lflatten(l):
     """Flat list from a nested one"""
+    if _is_ndarray(l):
+        return l.ravel().tolist()
     return  list(flatten(l))
 
+def flatten_ragged(l):
+    """Flatten a NumPy array or a list of arrays of different sizes (ragged) in one shot.
+
+    Return (flat array, offsets): the i-th element of l is flat[offsets[i]:offsets[i+1]], see unflatten_ragged.
+    A contiguous array is flattened without copy; its offsets refer to the rows."""
+    import numpy as np
+    if _is_ndarray(l):
+        row = l[0].size if l.ndim > 1 and len(l) else 1
+        return l.ravel(), np.arange(0, l.size+1, max(row, 1))
+    arrays = [np.ravel(x) for x in l]
+    offsets = np.zeros(len(arrays)+1, dtype=np.int64)
+    np.cumsum([a.size for a in arrays], out=offsets[1:])
+    flat = np.concatenate(arrays) if arrays else np.array([])
+    return flat, offsets
+
+def unflatten_ragged(flat, offsets):
+    """List of arrays (views of flat) from the output of flatten_ragged"""
+    return [flat[i:j] for i, j in zip(offsets[:-1], offsets[1:])]
+
 def list_uniq(l):
     """List of uniq elements in given list l.
-    Preserves original order, differently than set."""
+    Preserves original order, differently than set.
+
+    For numeric NumPy arrays the uniq elements (rows for N-dim arrays) are found with np.unique:
+    an array is returned, still in original order."""
+    if _is_ndarray(l) and l.dtype.kind in "biufcmMUS":
+        import numpy as np
+        if l.ndim == 0:
+            return l.reshape(1)
+        _, first = np.unique(l, axis=0 if l.ndim > 1 else None, return_index=True)
+        return l[np.sort(first)]
     seen = set()
     seen_add = seen.add # Faster than evaulating seen.add at each iter
     return [x for x in l if not (x in seen or seen_add(x))]
@@ -227,6 +937,7 @@ def list_uniq(l):
 #------------------------------------------------------------------------------#
 # Matplotlib utilities 
 #------------------------------------------------------------------------------#
+@profiled
 def colorbar(mappable):
     """Try to handle colorbar nicely"""
     from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -2,8 +2,10 @@
 
 import sys
 import os, argparse, logging
-from ase.io.vasp import read_vasp_xdatcar
-from ase.io.extxyz import write_xyz
+from useful_functions import lazy_import, enable_profiling, open_stream, COMPRESSIONS
+# Heavy packages are imported only when needed
+np = lazy_import("numpy")
+traj_io = lazy_import("traj_io")
 
 def xdatcar_to_xyz(argv):
     """Convert XDATCAR file to xyz.
@@ -12,7 +14,13 @@ def xdatcar_to_xyz(argv):
     After frame number is printed. If timestep is given, actual time is written; assumes fs.
     First comment line contains ASE object info as well.
 
-    Result is written on stdout."""
+    Frames are read one at a time: memory does not depend on the trajectory length.
+    They are formatted in blocks, by -j processes in parallel if requested.
+    With --start/--stop/--step only a slice of frames is converted. Uncompressed files are indexed once
+    (byte offset of each frame, saved in XDATCAR.index.npz), then the reader seeks straight to the frames.
+    With --traj the frames are written in a binary trajectory directory instead (traj_io.MemmapTrajectory),
+    with --append they are added to an existing one, from the first frame it does not have.
+    Input can be gzip, bz2 or xz compressed. Result is written on stdout, compressed with --compress."""
 
     #-------------------------------------------------------------------------------
     # Argument parser
@@ -27,6 +35,33 @@ def xdatcar_to_xyz(argv):
     parser.add_argument('--dt',
                         dest='dt', type=float, default=None,
                         help='timestep in femptosecon;')
+    parser.add_argument('--start',
+                        dest='start', type=int, default=None,
+                        help='first frame (default 0, negative counts from the end);')
+    parser.add_argument('--stop',
+                        dest='stop', type=int, default=None,
+                        help='frame to stop at, excluded (default last);')
+    parser.add_argument('--step',
+                        dest='step', type=int, default=None,
+                        help='take one frame every step (default 1);')
+    parser.add_argument('-z', '--compress',
+                        dest='compress', default=None, choices=COMPRESSIONS,
+                        help='compress output;')
+    parser.add_argument('--level',
+                        dest='level', type=int, default=None,
+                        help='compression level (default of the compression module);')
+    parser.add_argument('-j', '--n_proc',
+                        dest='n_proc', type=int, default=1,
+                        help='processes formatting the xyz frames, written in order (default 1);')
+    parser.add_argument('--traj',
+                        dest='traj', default=None, metavar='DIR',
+                        help='write a binary memory-mapped trajectory in DIR instead of xyz;')
+    parser.add_argument('--dtype',
+                        dest='dtype', default=None, choices=['float32', 'float64'],
+                        help='positions type in the binary trajectory (default float32, or the one of the trajectory appended to);')
+    parser.add_argument('--append',
+                        action='store_true', dest='append',
+                        help='append to the binary trajectory (default start: first missing frame);')
     parser.add_argument('--debug',
                         action='store_true', dest='debug',
                         help='show debug informations.')
@@ -43,7 +78,9 @@ def xdatcar_to_xyz(argv):
     logging.basicConfig(format=std_format)
     c_log.setLevel(logging.INFO)
     # Set debug option
-    if args.debug: c_log.setLevel(logging.DEBUG)
+    if args.debug:
+        c_log.setLevel(logging.DEBUG)
+        enable_profiling() # Report timings at exit
 
     c_log.debug(args)
 
@@ -53,20 +90,39 @@ def xdatcar_to_xyz(argv):
         args.dt = 1
         t_unit = ""
 
+    #-------------------------------------------------------------------------------
+    # Binary trajectory output
+    #-------------------------------------------------------------------------------
+    if args.traj:
+        with traj_io.Xdatcar(args.filename) as xdat, \
+             traj_io.TrajWriter(args.traj, xdat.symbols, args.dtype, append=args.append) as traj:
+            if args.append and args.start is None:
+                args.start = traj.n_frames
+            n_old = traj.n_frames
+            for t, cell, frac in xdat.frames(args.start, args.stop, args.step):
+                traj.write(np.dot(frac, cell), cell)
+            c_log.info("%i frames written in %s (%i in total)", traj.n_frames-n_old, args.traj, traj.n_frames)
+        return 0
+
     #-------------------------------------------------------------------------------
     # Load file and print xyz to stdout
     #-------------------------------------------------------------------------------
-    # Load xdatcar as list of Atoms obj
-    # For some reason we need to put index=0 to load all of it, otherwise is just the first.
-    for t, frame in enumerate(read_vasp_xdatcar(args.filename, index=0)):
-        c_line = "# %.6f %s " % (t*args.dt, t_unit)
-        # If it's the first line, print first atoms object info
-        # Here we are assuming that since it's MD, cell and compositions are not changing.
-        if t == 0:
-            c_line += "%s %s" % (frame, frame.info)
+    # Stream the frames and format them in blocks: output starts at once
+    with traj_io.Xdatcar(args.filename) as xdat, \
+         open_stream(None, 'w', compression=args.compress, level=args.level) as out_stream:
+        def xyz_frames():
+            for i, (t, cell, frac) in enumerate(xdat.frames(args.start, args.stop, args.step)):
+                c_line = "# %.6f %s " % (t*args.dt, t_unit)
+                # If it's the first line, print first atoms object info
+                # Here we are assuming that since it's MD, cell and compositions are not changing.
+                if i == 0:
+                    frame = xdat.to_atoms(cell, frac)
+                    c_line += "%s %s" % (frame, frame.info)
+                yield c_line, np.dot(frac, cell)
+        n_frames = traj_io.write_xyz_frames(out_stream, xdat.symbols, xyz_frames(), n_proc=args.n_proc)
+    c_log.debug("%i frames written", n_frames)
+    return 0
 
-        write_xyz(sys.stdout, frame, append=True,
-                  comment=c_line)
 # If executed as bash script, execute function and return exit status to bash
 if __name__ == "__main__":
     # From https://github.com/python/mypy/issues/2893